@@ -0,0 +1,130 @@
+""" Builds a synthetic kennel database of any size for benchmarking.
+
+The schema comes from kennel.sql and the indexes from the migrations,
+so the database is exactly what the server would run against. Rows are
+made by generators and inserted in batches, so millions of animals can
+be written without holding them in memory.
+
+Run it with:  python -m benchmarks.dataset --animals 1000000 bench.sqlite3
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import time
+
+from database.migrations import migrate
+
+STATUSES = ("Kennel", "Treatment", "Recreation")
+BREEDS = ("Beagle", "Poodle", "Boxer", "Siamese", "Dalmation", "Bulldog",
+          "Labrador", "Persian")
+
+# Rows handed to executemany at a time
+BATCH_SIZE = 10000
+
+
+def scale(animals, customers=None, employees=None, locations=None):
+    """ How many of each resource a database with `animals` animals has,
+    unless given: one customer for every four animals, a location for
+    every thousand animals and ten employees at each location """
+    locations = locations if locations is not None \
+        else max(10, animals // 1000)
+    return {
+        "animals": animals,
+        "customers": customers if customers is not None
+        else max(10, animals // 4),
+        "employees": employees if employees is not None else locations * 10,
+        "locations": locations,
+    }
+
+
+def _insert(conn, sql, rows):
+    """ Inserts rows from a generator a batch at a time """
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+
+
+def build_database(path, animals, customers=None, employees=None,
+                   locations=None):
+    """ Writes a new database at `path`, replacing any file there
+
+    Args:
+        path (str): where to write the database
+        animals (int): how many animals to make
+        customers, employees, locations (int): how many of each to make;
+            by default they grow with the number of animals, see scale()
+
+    Returns:
+        dict: how many of each resource were made
+    """
+    counts = scale(animals, customers, employees, locations)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        # Nothing needs to survive a crash half way through building
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+
+        with open("kennel.sql", encoding="utf-8") as schema:
+            conn.executescript(schema.read())
+        for table in ("Animal", "Employee", "Customer", "Location"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("DELETE FROM sqlite_sequence")
+
+        _insert(conn,
+                "INSERT INTO Location (name, address) VALUES (?, ?)",
+                ((f"Location {i}", f"{i} Main St")
+                 for i in range(counts["locations"])))
+        _insert(conn,
+                "INSERT INTO Customer (name, address, email, password) "
+                "VALUES (?, ?, ?, ?)",
+                ((f"Customer {i}", f"{i} Elm St", f"c{i}@example.com",
+                  "password") for i in range(counts["customers"])))
+        _insert(conn,
+                "INSERT INTO Employee (name, address, location_id) "
+                "VALUES (?, ?, ?)",
+                ((f"Employee {i}", f"{i} Oak St",
+                  1 + i % counts["locations"])
+                 for i in range(counts["employees"])))
+        _insert(conn,
+                "INSERT INTO Animal (name, status, breed, customer_id, "
+                "location_id) VALUES (?, ?, ?, ?, ?)",
+                ((f"Animal {i}", STATUSES[i % len(STATUSES)],
+                  BREEDS[i % len(BREEDS)], 1 + i % counts["customers"],
+                  1 + i % counts["locations"])
+                 for i in range(counts["animals"])))
+        conn.commit()
+    finally:
+        conn.close()
+
+    migrate(path)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("path", nargs="?", default="bench.sqlite3")
+    parser.add_argument("--animals", type=int, default=10000)
+    parser.add_argument("--customers", type=int)
+    parser.add_argument("--employees", type=int)
+    parser.add_argument("--locations", type=int)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = build_database(args.path, args.animals, args.customers,
+                            args.employees, args.locations)
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.path}: " + ", ".join(
+        f"{count} {resource}" for (resource, count) in counts.items())
+        + f" in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
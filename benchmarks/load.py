@@ -0,0 +1,355 @@
+""" Load-tests every route of the server against a synthetic database and
+reports throughput and latency for each one.
+
+The server is started in a subprocess on a free port, against a
+database built by benchmarks.dataset, and each endpoint is driven in
+turn by --clients threads, each on its own kept-alive connection, for
+--seconds. Results are printed as a table and written as JSON to
+--output, with stable key order so two runs can be diffed or compared:
+
+    python -m benchmarks.load --animals 100000 --output before.json
+    ... change something ...
+    python -m benchmarks.load --animals 100000 --output after.json
+    python -m benchmarks.load --compare before.json after.json
+
+Anything after -- is passed on to request_handler.py, e.g.
+    python -m benchmarks.load -- --asyncio --threads 16
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .dataset import build_database
+
+
+class Endpoint():
+    """ One kind of request to measure
+
+    Args:
+        name (str): how it is reported, e.g. "GET /animals/{id}"
+        method (str): the HTTP method
+        path (function): (random, counts) -> the url to request
+        body (function): (random, counts) -> the JSON body to send, or None
+        headers (dict): extra headers to send
+        expect (tuple): status codes that count as success
+    """
+
+    def __init__(self, name, method, path, body=None, headers=None,
+                 expect=(200,)):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+        self.expect = expect
+
+
+def _animal(rng, counts):
+    return {"name": "Bench", "breed": "Beagle", "status": "Kennel",
+            "locationId": rng.randint(1, counts["locations"]),
+            "customerId": rng.randint(1, counts["customers"])}
+
+
+def endpoints(counts):
+    """ Every route the server has, with randomised ids and filters """
+    def any_id(resource):
+        return lambda rng, counts: \
+            f"/{resource}/{rng.randint(1, counts[resource])}"
+
+    def some_ids(rng, counts):
+        ids = (str(rng.randint(1, counts["animals"])) for _ in range(20))
+        return "/animals?id=" + ",".join(ids)
+
+    def page(resource, extra=""):
+        def path(rng, counts):
+            after = rng.randint(0, max(0, counts[resource] - 100))
+            return f"/{resource}?limit=100&after={after}{extra}"
+        return path
+
+    return [
+        Endpoint("GET /animals?limit=100", "GET", page("animals")),
+        Endpoint("GET /animals?limit=100&_expand=location,customer", "GET",
+                 page("animals", "&_expand=location,customer")),
+        Endpoint("GET /animals?limit=100 gzip", "GET", page("animals"),
+                 headers={"Accept-Encoding": "gzip"}),
+        Endpoint("GET /animals/{id}", "GET", any_id("animals")),
+        Endpoint("GET /animals/{id}?_expand=location,customer", "GET",
+                 lambda rng, counts: any_id("animals")(rng, counts)
+                 + "?_expand=location,customer"),
+        Endpoint("GET /animals?id=<20 ids>", "GET", some_ids),
+        Endpoint("GET /animals?status=&location_id=&limit=100", "GET",
+                 lambda rng, counts:
+                 f"/animals?status=Kennel&location_id="
+                 f"{rng.randint(1, counts['locations'])}&limit=100"),
+        Endpoint("GET /animals?q=", "GET",
+                 lambda rng, counts:
+                 f"/animals?q={rng.randrange(counts['animals'])}"),
+        Endpoint("GET /customers?limit=100", "GET", page("customers")),
+        Endpoint("GET /customers/{id}", "GET", any_id("customers")),
+        Endpoint("GET /customers?email=", "GET",
+                 lambda rng, counts:
+                 f"/customers?email=c{rng.randrange(counts['customers'])}"
+                 f"@example.com"),
+        Endpoint("GET /customers?q=", "GET",
+                 lambda rng, counts:
+                 f"/customers?q={rng.randrange(counts['customers'])}"),
+        Endpoint("GET /employees?limit=100", "GET", page("employees")),
+        Endpoint("GET /employees/{id}", "GET", any_id("employees")),
+        Endpoint("GET /employees?location_id=", "GET",
+                 lambda rng, counts:
+                 f"/employees?location_id="
+                 f"{rng.randint(1, counts['locations'])}"),
+        Endpoint("GET /locations", "GET", lambda rng, counts: "/locations"),
+        Endpoint("GET /locations/{id}", "GET", any_id("locations")),
+        Endpoint("GET /animals?limit=100 If-None-Match", "GET",
+                 lambda rng, counts: "/animals?limit=100",
+                 headers={"If-None-Match": "*"}, expect=(304,)),
+        Endpoint("GET /stats", "GET", lambda rng, counts: "/stats"),
+        Endpoint("GET /metrics", "GET", lambda rng, counts: "/metrics"),
+        Endpoint("POST /animals", "POST",
+                 lambda rng, counts: "/animals", _animal, expect=(201,)),
+        Endpoint("POST /animals <50 animals>", "POST",
+                 lambda rng, counts: "/animals",
+                 lambda rng, counts: [_animal(rng, counts)
+                                      for _ in range(50)],
+                 expect=(201,)),
+        Endpoint("PUT /animals/{id}", "PUT", any_id("animals"), _animal,
+                 expect=(204,)),
+        # Last, since it removes rows the others read
+        Endpoint("DELETE /animals/{id}", "DELETE", any_id("animals"),
+                 expect=(204,)),
+    ]
+
+
+def percentile(ordered, q):
+    """ The q-th quantile of a sorted list, by nearest rank """
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+def drive(port, endpoint, counts, clients, seconds, seed):
+    """ Sends one endpoint's requests from `clients` threads for
+    `seconds` and measures every one
+
+    Returns:
+        dict: requests, errors, throughput and latency in milliseconds
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(number):
+        rng = random.Random(seed + number)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            body = endpoint.body(rng, counts) if endpoint.body else None
+            payload = json.dumps(body) if body is not None else None
+            started = time.perf_counter()
+            try:
+                conn.request(endpoint.method, endpoint.path(rng, counts),
+                             payload, endpoint.headers)
+                response = conn.getresponse()
+                response.read()
+                mine.append(time.perf_counter() - started)
+                if response.status not in endpoint.expect:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port,
+                                                  timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number, ))
+               for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": _round(percentile(milliseconds, 0.50)),
+        "p99_ms": _round(percentile(milliseconds, 0.99)),
+        "mean_ms": _round(sum(milliseconds) / len(milliseconds)
+                          if milliseconds else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, path, server_args):
+    """ Starts request_handler.py and waits until it answers """
+    process = subprocess.Popen(
+        [sys.executable, "request_handler.py", "--host", "127.0.0.1",
+         "--port", str(port), "--database", path] + server_args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("the server exited while starting")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/locations/1")
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("the server did not start within 30 seconds")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, server_args):
+    """ Builds the database, starts the server and measures every
+    endpoint that --only selects """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        counts = build_database(path, args.animals, args.customers,
+                                args.employees, args.locations)
+
+        port = free_port()
+        server = start_server(port, path, server_args)
+        try:
+            results = {}
+            for endpoint in endpoints(counts):
+                if args.only and not any(part in endpoint.name
+                                         for part in args.only):
+                    continue
+                results[endpoint.name] = drive(
+                    port, endpoint, counts, args.clients, args.seconds,
+                    args.seed)
+                print_row(endpoint.name, results[endpoint.name])
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "scale": counts,
+        "clients": args.clients,
+        "seconds": args.seconds,
+        "server_args": server_args,
+        "endpoints": results,
+    }
+
+
+def print_row(name, result):
+    print(f"{name:<52}{result['requests_per_second']:>10.1f}"
+          f"{_format(result['p50_ms']):>10}{_format(result['p99_ms']):>10}"
+          f"{result['errors']:>8}")
+
+
+def _format(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def compare(before_path, after_path):
+    """ Prints the change in throughput and p99 for every endpoint two
+    result files share """
+    with open(before_path, encoding="utf-8") as before_file:
+        before = json.load(before_file)["endpoints"]
+    with open(after_path, encoding="utf-8") as after_file:
+        after = json.load(after_file)["endpoints"]
+
+    print(f"{'endpoint':<52}{'req/s':>10}{'change':>9}"
+          f"{'p99 ms':>10}{'change':>9}")
+    for (name, new) in after.items():
+        old = before.get(name)
+        if old is None:
+            continue
+        print(f"{name:<52}{new['requests_per_second']:>10.1f}"
+              f"{_change(old['requests_per_second'], new['requests_per_second']):>9}"
+              f"{_format(new['p99_ms']):>10}"
+              f"{_change(old['p99_ms'], new['p99_ms']):>9}")
+
+
+def _change(old, new):
+    if not old or new is None:
+        return "-"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    server_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        (argv, server_args) = (argv[:split], argv[split + 1:])
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--animals", type=int, default=10000)
+    parser.add_argument("--customers", type=int)
+    parser.add_argument("--employees", type=int)
+    parser.add_argument("--locations", type=int)
+    parser.add_argument("--clients", type=int, default=8,
+                        help="concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=5,
+                        help="how long each endpoint is driven")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="*",
+                        help="only endpoints whose name contains one of these")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    print(f"{'endpoint':<52}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}")
+    results = run(args, server_args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+""" Compares the memory and time it takes to turn a large joined Animal
+table into JSON four ways:
+
+  dict     the original get_all_animals(): three models per row, each
+           keeping its attributes in a per-instance __dict__, collected
+           into a list and encoded at once
+  slots    the same with the __slots__ models and Model.to_dict()
+  rows     repository.iter_rows(), which maps each tuple row straight to
+           its dictionary without building models, collected and encoded
+           at once as a paginated response is
+  stream   repository.iter_rows(encoded=True), which encodes batches of
+           mapped rows and is consumed a batch at a time as a streamed
+           response is
+
+Run it with:  python -m benchmarks.model_memory --animals 200000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import database
+from database import repository
+from database.entities import ANIMAL
+from models import Animal, Customer, Location
+
+from .dataset import build_database
+
+JOINS = ("location", "customer")
+
+
+class DictLocation():
+    """ The Location model as it was before __slots__ """
+
+    def __init__(self, id, name, address):
+        self.id = id
+        self.name = name
+        self.address = address
+
+
+class DictCustomer():
+    """ The Customer model as it was before __slots__ """
+
+    def __init__(self, id, name, address, email="", password=""):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.email = email
+        self.password = password
+
+
+class DictAnimal():
+    """ The Animal model as it was before __slots__ """
+
+    def __init__(self, id, name, breed, status, customer_id, location_id):
+        self.id = id
+        self.name = name
+        self.breed = breed
+        self.status = status
+        self.location_id = location_id
+        self.customer_id = customer_id
+        self.location = None
+        self.customer = None
+
+
+def with_dict_models():
+    """ The original get_all_animals(): three models and three __dict__s
+    per row, all held in a list until json.dumps() """
+    animals = []
+    with database.connect() as conn:
+        for row in conn.execute(repository.select_sql(ANIMAL, JOINS)):
+            location = DictLocation(row["location__id"], row["location__name"],
+                                    row["location__address"])
+            customer = DictCustomer(row["customer__id"], row["customer__name"],
+                                    row["customer__address"],
+                                    row["customer__email"],
+                                    row["customer__password"])
+            animal = DictAnimal(row["id"], row["name"], row["breed"],
+                                row["status"], row["customer_id"],
+                                row["location_id"])
+            animal.location = location.__dict__
+            animal.customer = customer.__dict__
+            animals.append(animal.__dict__)
+    return len(json.dumps(animals))
+
+
+def with_slotted_models():
+    """ The same loop with the __slots__ models and to_dict() """
+    animals = []
+    with database.connect() as conn:
+        for row in conn.execute(repository.select_sql(ANIMAL, JOINS)):
+            location = Location(row["location__id"], row["location__name"],
+                                row["location__address"])
+            customer = Customer(row["customer__id"], row["customer__name"],
+                                row["customer__address"],
+                                row["customer__email"],
+                                row["customer__password"])
+            animal = Animal(row["id"], row["name"], row["breed"],
+                            row["status"], row["customer_id"],
+                            row["location_id"])
+            animal.location = location.to_dict()
+            animal.customer = customer.to_dict()
+            animals.append(animal.to_dict())
+    return len(json.dumps(animals))
+
+
+def with_mapped_rows():
+    """ Dictionaries mapped straight from tuple rows, collected then
+    encoded """
+    animals = list(repository.iter_rows(ANIMAL, joins=JOINS))
+    return len(json.dumps(animals))
+
+
+def with_streamed_rows():
+    """ JSON text for batches of rows, consumed as it is made """
+    size = 2
+    for text in repository.iter_rows(ANIMAL, joins=JOINS, encoded=True):
+        size += len(text) + 2
+    return size
+
+
+APPROACHES = {
+    "dict": with_dict_models,
+    "slots": with_slotted_models,
+    "rows": with_mapped_rows,
+    "stream": with_streamed_rows,
+}
+
+
+def instance_sizes():
+    """ Bytes used by one Animal instance in each model style """
+    old = DictAnimal(1, "Rex", "Beagle", "Kennel", 1, 1)
+    new = Animal(1, "Rex", "Beagle", "Kennel", 1, 1)
+    return {
+        "dict": sys.getsizeof(old) + sys.getsizeof(old.__dict__),
+        "slots": sys.getsizeof(new),
+    }
+
+
+def measure(approach, repeat):
+    """ Best wall time over `repeat` runs, then peak traced memory """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        approach()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    approach()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": round(best, 4), "peak_bytes": peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--animals", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        build_database(path, args.animals, customers=1000, employees=0,
+                       locations=20)
+        database.configure(database=path, size=1)
+
+        results = {
+            "animals": args.animals,
+            "instance_bytes": instance_sizes(),
+            "approaches": {name: measure(approach, args.repeat)
+                           for (name, approach) in APPROACHES.items()},
+        }
+        database.get_pool().close()
+
+    print(f"{args.animals} animals, joined to location and customer")
+    print(f"Animal instance: {results['instance_bytes']['dict']} bytes with "
+          f"__dict__, {results['instance_bytes']['slots']} with __slots__")
+    print(f"{'approach':<10}{'seconds':>10}{'rows/s':>12}{'peak MB':>10}")
+    for (name, result) in results["approaches"].items():
+        rate = args.animals / result["seconds"]
+        print(f"{name:<10}{result['seconds']:>10.3f}{rate:>12.0f}"
+              f"{result['peak_bytes'] / 2**20:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
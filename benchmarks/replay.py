@@ -0,0 +1,183 @@
+""" Replays requests captured with `request_handler.py --capture FILE`
+against a running server, keeping their original spacing in time or
+speeding it up, and reports latency per route.
+
+    python request_handler.py --capture captured_requests.jsonl
+    ... let real traffic run ...
+    python -m benchmarks.replay captured_requests.jsonl --port 8088 \\
+        --speed 4 --output before.json
+
+The output has the same shape as benchmarks.load's, so two replays can
+be compared with:  python -m benchmarks.load --compare before.json after.json
+
+Writes are replayed too, so point it at a copy of the database.
+Requests for /changes are left out: an event stream stays open until
+the client goes away, so it has no latency to report and would hold a
+client until its read timed out.
+"""
+import argparse
+import http.client
+import json
+import queue
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from .load import percentile, print_row
+
+# Headers that describe the original connection rather than the request
+HOP_BY_HOP = {"connection", "keep-alive", "content-length", "host",
+              "transfer-encoding", "te", "upgrade", "proxy-connection"}
+
+# Routes that answer with a stream that never ends, so aren't replayed
+STREAMS = {"/changes"}
+
+
+def load_capture(path):
+    """ The captured requests in a file, oldest first, leaving out those
+    for STREAMS """
+    requests = []
+    with open(path, encoding="utf-8") as capture:
+        for line in capture:
+            if line.strip():
+                request = json.loads(line)
+                if urlparse(request["path"]).path.rstrip("/") not in STREAMS:
+                    requests.append(request)
+    requests.sort(key=lambda request: request["ts"])
+    return requests
+
+
+def route_of(method, path):
+    """ The name a request is reported under, e.g. GET /animals/{id} """
+    parts = urlparse(path).path.split("/")
+    route = f"/{parts[1]}" if len(parts) > 1 else "/"
+    if len(parts) > 2 and parts[2]:
+        route += "/{id}"
+    return f"{method} {route}"
+
+
+def replay(requests, host, port, speed, clients):
+    """ Sends every request at its captured offset divided by speed, or
+    as fast as the clients can when speed is 0
+
+    Returns:
+        dict: route -> list of (seconds, status matched the capture,
+            seconds late)
+    """
+    pending = queue.Queue(clients * 4)
+    results = {}
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            (request, late) = item
+
+            headers = {name: value
+                       for (name, value) in request["headers"].items()
+                       if name.lower() not in HOP_BY_HOP}
+            body = request["body"].encode() if request["body"] else None
+
+            started = time.perf_counter()
+            try:
+                conn.request(request["method"], request["path"], body,
+                             headers)
+                response = conn.getresponse()
+                response.read()
+                matched = response.status == request["status"]
+            except (OSError, http.client.HTTPException):
+                matched = False
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+            elapsed = time.perf_counter() - started
+
+            route = route_of(request["method"], request["path"])
+            with lock:
+                results.setdefault(route, []).append(
+                    (elapsed, matched, late))
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    first = requests[0]["ts"] if requests else 0
+    for request in requests:
+        due = (request["ts"] - first) / speed if speed else 0
+        wait = due - (time.perf_counter() - started)
+        if wait > 0:
+            time.sleep(wait)
+        pending.put((request, max(0.0, -wait)))
+
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+
+    return (results, time.perf_counter() - started)
+
+
+def summarise(results, elapsed):
+    """ The same figures benchmarks.load reports, for every route """
+    summary = {}
+    for (route, samples) in sorted(results.items()):
+        milliseconds = sorted(seconds * 1000 for (seconds, _, _) in samples)
+        late = sorted(lag * 1000 for (_, _, lag) in samples)
+        summary[route] = {
+            "requests": len(samples),
+            "errors": sum(1 for (_, matched, _) in samples if not matched),
+            "requests_per_second": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(milliseconds, 0.50), 3),
+            "p99_ms": round(percentile(milliseconds, 0.99), 3),
+            "mean_ms": round(sum(milliseconds) / len(milliseconds), 3),
+            "p99_late_ms": round(percentile(late, 0.99), 3),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("capture", help="a file written by --capture")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--speed", type=float, default=1,
+                        help="how many times faster than captured to "
+                             "replay; 0 sends them back to back")
+    parser.add_argument("--clients", type=int, default=16,
+                        help="connections to send from; requests that are "
+                             "due while all of them are busy are sent late")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    requests = load_capture(args.capture)
+    if not requests:
+        sys.exit(f"{args.capture} has no requests in it")
+
+    (results, elapsed) = replay(requests, args.host, args.port, args.speed,
+                                args.clients)
+    summary = summarise(results, elapsed)
+
+    print(f"{len(requests)} requests in {elapsed:.1f}s")
+    print(f"{'route':<52}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}")
+    for (route, result) in summary.items():
+        print_row(route, result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({
+                "capture": args.capture,
+                "speed": args.speed,
+                "clients": args.clients,
+                "endpoints": summary,
+            }, output, indent=2)
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from database import changes, versions
+
+# How often the version counters are looked at for new writes; reading
+# them is a few loads from shared memory, so this can be frequent
+POLL_INTERVAL = 0.05
+
+# How often the changes table is read even if no counter moved, to pick
+# up writes made outside the server, such as an import
+FALLBACK_INTERVAL = 5.0
+
+# Seconds between comments sent to idle streams, so proxies keep them
+# open and clients that went away are noticed
+HEARTBEAT_INTERVAL = 15.0
+
+# A client that can't take an event within this many seconds is dropped;
+# it reconnects with Last-Event-ID and misses nothing
+SEND_TIMEOUT = 5.0
+
+# Changes read from the table at a time
+BATCH_SIZE = 1000
+
+
+def format_event(change):
+    """ One Server-Sent Event for a (id, resource, entity id, action) row """
+    (id, resource, entity_id, action) = change
+    data = json.dumps({"resource": resource, "id": entity_id,
+                       "action": action})
+    return f"id: {id}\ndata: {data}\n\n".encode()
+
+
+class _Subscriber():
+    """ One open event stream and where it has got to """
+
+    def __init__(self, sock, after, resources):
+        self.sock = sock
+        self.after = after
+        self.resources = resources
+
+    def wants(self, change):
+        return self.resources is None or change[1] in self.resources
+
+
+class ChangeFeed():
+    """ Sends every create, update and delete to the open /changes event
+    streams as it is committed.
+
+    One thread per process does all the work: it notices writes from the
+    version counters, which every pre-fork worker shares, reads the new
+    rows of the changes table once and writes them to every stream, so
+    a thousand listening clients cost one thread rather than a thousand.
+    The streams' connections are handed over by the request handler,
+    which goes back to serving other requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._joining = []
+        self._subscribers = []
+        self._last_id = None
+        self._pid = None
+
+    def subscribe(self, sock, after=None, resources=None):
+        """ Takes over an open connection that has had its response
+        headers sent, and writes events to it until it closes
+
+        Args:
+            sock (socket): the connection
+            after (int): the id of the last event the client saw, from
+                Last-Event-ID; None to start with the next change
+            resources (set): the resources to send changes of, or None
+                for all of them
+        """
+        sock.settimeout(SEND_TIMEOUT)
+        with self._lock:
+            # A forked worker doesn't inherit its parent's thread
+            if self._pid != os.getpid():
+                self._joining = []
+                self._subscribers = []
+                self._last_id = changes.last_change_id()
+                self._pid = os.getpid()
+                threading.Thread(target=self._send_forever,
+                                 name="change-feed", daemon=True).start()
+            if after is None:
+                after = self._last_id
+            self._joining.append(_Subscriber(sock, after, resources))
+
+    def _send_forever(self):
+        seen = versions.current()
+        read_at = time.monotonic()
+        beat_at = time.monotonic()
+
+        while True:
+            time.sleep(POLL_INTERVAL)
+            now = time.monotonic()
+
+            new = []
+            current = versions.current()
+            if current != seen or now - read_at >= FALLBACK_INTERVAL:
+                (seen, read_at) = (current, now)
+                try:
+                    new = self._read_new()
+                except sqlite3.OperationalError:
+                    # Busy or locked; the next look will find them
+                    seen = None
+
+            if new:
+                for subscriber in self._subscribers:
+                    self._send(subscriber, b"".join(
+                        format_event(change) for change in new
+                        if subscriber.wants(change)))
+
+            with self._lock:
+                (joining, self._joining) = (self._joining, [])
+            for subscriber in joining:
+                try:
+                    self._catch_up(subscriber)
+                except sqlite3.OperationalError:
+                    with self._lock:
+                        self._joining.append(subscriber)
+                    continue
+                self._subscribers.append(subscriber)
+
+            if now - beat_at >= HEARTBEAT_INTERVAL:
+                beat_at = now
+                for subscriber in self._subscribers:
+                    self._send(subscriber, b": keep-alive\n\n")
+
+            self._subscribers = [subscriber for subscriber in self._subscribers
+                                 if subscriber.sock is not None]
+
+    def _read_new(self):
+        """ Every change committed since the last one sent """
+        new = []
+        while True:
+            batch = changes.changes_after(
+                new[-1][0] if new else self._last_id, BATCH_SIZE)
+            new += batch
+            if len(batch) < BATCH_SIZE:
+                break
+        if new:
+            self._last_id = new[-1][0]
+        return new
+
+    def _catch_up(self, subscriber):
+        """ Sends a new stream the changes it missed since its
+        Last-Event-ID, up to the ones every stream has been sent """
+        if subscriber.after >= self._last_id:
+            return
+
+        first = changes.first_change_id()
+        if first is not None and subscriber.after < first - 1:
+            # The ones it missed are no longer kept, so it has to fetch
+            # everything again
+            self._send(subscriber, b"event: reset\ndata: {}\n\n")
+            subscriber.after = self._last_id
+            return
+
+        while subscriber.sock is not None \
+                and subscriber.after < self._last_id:
+            batch = [change for change
+                     in changes.changes_after(subscriber.after, BATCH_SIZE)
+                     if change[0] <= self._last_id]
+            if not batch:
+                break
+            subscriber.after = batch[-1][0]
+            self._send(subscriber, b"".join(
+                format_event(change) for change in batch
+                if subscriber.wants(change)))
+
+    def _send(self, subscriber, data):
+        if not data or subscriber.sock is None:
+            return
+        try:
+            subscriber.sock.sendall(data)
+        except OSError:
+            try:
+                subscriber.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            subscriber.sock.close()
+            subscriber.sock = None
+
+
+# Shared by every request thread in a process
+FEED = ChangeFeed()
@@ -0,0 +1,118 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+# Bodies smaller than this are sent as they are; compressing them saves
+# less than it costs
+MIN_SIZE = 1024
+
+# zlib window bits for each Content-Encoding we can produce; 31 writes a
+# gzip header and trailer, 15 the zlib wrapper HTTP calls "deflate"
+ENCODINGS = {"gzip": 31, "deflate": 15}
+
+LEVEL = 6
+
+
+def negotiate(accept_encoding):
+    """ Picks the encoding to send from an Accept-Encoding header
+
+    The encoding with the highest q value wins, gzip on a tie. One with
+    q=0 is never picked.
+
+    Args:
+        accept_encoding (str): the header, or None if it wasn't sent
+
+    Returns:
+        str: "gzip" or "deflate", or None to send the body as it is
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        (name, _, params) = item.strip().partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            (key, _, value) = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+
+        if name == "*":
+            for encoding in ENCODINGS:
+                weights.setdefault(encoding, weight)
+        elif name in ENCODINGS:
+            weights[name] = weight
+
+    best = None
+    for encoding in ENCODINGS:
+        if weights.get(encoding, 0) > weights.get(best, 0):
+            best = encoding
+    return best
+
+
+def compressor(encoding):
+    """ A zlib compressor writing the given Content-Encoding """
+    return zlib.compressobj(LEVEL, zlib.DEFLATED, ENCODINGS[encoding])
+
+
+def compress(data, encoding):
+    """ Compresses a whole body in the given Content-Encoding """
+    stream = compressor(encoding)
+    return stream.compress(data) + stream.flush()
+
+
+class ResponseCache():
+    """ Keeps the most recently sent compressed responses, so a client
+    polling a collection that hasn't changed gets the same bytes again
+    without a query or any encoding.
+
+    Entries are keyed on (path, ETag, encoding). Writes change the ETag,
+    so an entry for data that has since changed is never looked up again
+    and falls out as newer ones are added.
+
+    Args:
+        max_bytes (int): the most compressed bytes kept in all
+        max_entry_bytes (int): larger bodies are never kept
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024,
+                 max_entry_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ (body, headers) for a key, or None """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers):
+        """ Keeps a compressed body and the headers sent with it """
+        if len(body) > self.max_entry_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+
+            self._entries[key] = (body, dict(headers))
+            self._size += len(body)
+
+            # Drop the least recently used entries until it fits again
+            while self._size > self.max_bytes:
+                (_, (dropped, _)) = self._entries.popitem(last=False)
+                self._size -= len(dropped)
+
+
+# Shared by every request thread in a process
+RESPONSE_CACHE = ResponseCache()
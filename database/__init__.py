@@ -0,0 +1,19 @@
+from .connection import ConnectionPool, DATABASE_PATH
+
+from .connection import configure, connect, get_pool
+
+from .connection import Replica, get_replica, read, read_batch
+
+from .writer import Writer, get_writer, write
+
+from .pagination import MAX_PAGE_SIZE, keyset_page
+
+from . import versions
+
+from .entities import ANIMAL, CUSTOMER, EMPLOYEE, LOCATION, ENTITIES
+
+from . import repository
+
+from . import stats
+
+from . import changes
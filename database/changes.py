@@ -0,0 +1,76 @@
+from . import versions
+from .connection import connect, read
+
+
+def changes_after(after, limit=1000):
+    """ The changes made since the one with id `after`, oldest first
+
+    Every create, update and delete is added to the changes table by the
+    triggers of migration 4, in the order they were committed.
+
+    Args:
+        after (int): the id of the last change already seen, 0 for all
+        limit (int): the most changes to return
+
+    Returns:
+        list: (id, resource, entity id, action) tuples, where action is
+            "create", "update" or "delete"
+    """
+    with read() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+        return db_cursor.execute(
+            "SELECT id, resource, entity_id, action FROM changes "
+            "WHERE id > ? ORDER BY id LIMIT ?", (after, limit)).fetchall()
+
+
+def last_change_id():
+    """ The id of the newest change, or 0 if there are none """
+    with read() as conn:
+        return conn.execute(
+            "SELECT IFNULL(MAX(id), 0) FROM changes").fetchone()[0]
+
+
+def first_change_id():
+    """ The id of the oldest change still kept, or None if there are none """
+    with read() as conn:
+        return conn.execute("SELECT MIN(id) FROM changes").fetchone()[0]
+
+
+def bump_versions(after, batch_size=1000):
+    """ Gives everything changed since the change with id `after` new
+    ETags. The server bumps the counters itself for its own writes; this
+    is for those made to the file by another process, such as
+    database.importer, and reads the file even when there is a replica.
+
+    Args:
+        after (int): the id of the last change already accounted for
+
+    Returns:
+        int: the id of the newest change, to pass as `after` next time
+    """
+    with connect() as conn:
+        first = conn.execute("SELECT MIN(id) FROM changes").fetchone()[0]
+        if first is not None and after < first - 1:
+            # Some of the changes are no longer kept, so anything may
+            # have changed
+            versions.bump_all()
+            return conn.execute("SELECT MAX(id) FROM changes").fetchone()[0]
+
+        while True:
+            batch = conn.execute(
+                "SELECT id, resource, entity_id FROM changes "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (after, batch_size)).fetchall()
+            if not batch:
+                return after
+
+            changed = {}
+            for (_, resource, entity_id) in batch:
+                changed.setdefault(resource, []).append(entity_id)
+            for (resource, ids) in changed.items():
+                versions.bump_many(resource, ids)
+
+            after = batch[-1][0]
+            if len(batch) < batch_size:
+                return after
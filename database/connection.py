@@ -0,0 +1,451 @@
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+
+from telemetry import TimedConnection
+
+from . import versions
+from .entities import ENTITIES
+
+DATABASE_PATH = "./kennel.sqlite3"
+
+# Prepared statements each connection keeps, keyed on their SQL text.
+# The repository reuses the same text for every call, so this only has
+# to be large enough to hold every statement it generates.
+STATEMENT_CACHE_SIZE = 256
+
+replica_log = logging.getLogger("kennel.replica")
+
+
+class ConnectionPool():
+    """ Keeps a fixed number of open SQLite connections that request
+    threads borrow and hand back, so no request pays the cost of
+    opening the database file itself.
+
+    Args:
+        database (str): path to the SQLite database file, or a file: URI
+        size (int): the most connections the pool will ever open
+        timeout (float): seconds to wait for a free connection or a lock
+        read_only (bool): the connections are for an in-memory replica,
+            which they may only read and read without locking
+    """
+
+    def __init__(self, database=DATABASE_PATH, size=1, timeout=30,
+                 read_only=False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.read_only = read_only
+        self.closed = False
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """ Opens one connection with the settings every view expects """
+        conn = sqlite3.connect(
+            self.database, timeout=self.timeout, check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=TimedConnection, uri=self.read_only)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if not self.read_only:
+            # Readers see the last commit while a write is in progress
+            # instead of waiting for it; the mode is kept in the file
+            conn.execute("PRAGMA journal_mode = WAL")
+        else:
+            # Readers of a shared-cache database lock each table they
+            # read, which would make the replica's writer fail at once
+            # rather than wait; without the locks they never block it.
+            # They would also see its writes before they are committed,
+            # so the replica keeps its writes and reads apart itself.
+            conn.execute("PRAGMA read_uncommitted = 1")
+            conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def acquire(self):
+        """ Takes an idle connection, opening a new one while under the limit """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty as ex:
+            raise sqlite3.OperationalError(
+                "timed out waiting for a database connection") from ex
+
+    def release(self, conn):
+        """ Gives a connection back to the pool in a clean state """
+        if conn.in_transaction:
+            conn.rollback()
+        if self.closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """ Borrows a connection for the length of a `with` block.
+
+        Like `with sqlite3.connect(...)`, the work done inside the block is
+        committed when it finishes and rolled back if it raises.
+        """
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """ Closes every idle connection, and every busy one once it is
+        given back """
+        self.closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+class SharedLock():
+    """ A lock any number of threads can hold at once with shared(), or
+    one thread alone with exclusive(). A thread waiting for exclusive()
+    goes before any that ask for shared() after it, so a steady stream of
+    readers can't keep it waiting. """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._exclusive or self._waiting:
+                self._condition.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                if not self._shared:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._condition.wait()
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class Replica():
+    """ An in-memory copy of the database file that reads are served
+    from, so they never wait on the disk or the page cache.
+
+    The copy is made with the backup API. Every write goes to the file
+    first and, once the writer has committed them there, the same
+    changes are applied to the copy in the same order.
+    If the copy ever disagrees with the file about how many rows a
+    write changed, it is thrown away and copied again.
+
+    The copy is shared-cache, which has no snapshots: a reader would see
+    a write half done. So reads hold reading() while they read, and each
+    batch of writes is applied only while no read holds it.
+
+    Only writes made through this process reach the copy, so it can't
+    be shared by pre-fork workers, and changes made to the file by
+    anything else are not seen until a check finds them.
+
+    Args:
+        database (str): path to the SQLite database file
+        size (int): the most read connections to open
+        timeout (float): seconds to wait for a free connection or a lock
+    """
+
+    _names = itertools.count()
+
+    def __init__(self, database=DATABASE_PATH, size=1, timeout=30):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pool = None
+        self._writer = None
+        self._lock = threading.RLock()
+        self._reads = SharedLock()
+        self.load()
+
+    def load(self):
+        """ Copies the database file into a new in-memory database and
+        moves reads over to it; reads already running finish on the old
+        one """
+        with self._lock:
+            uri = (f"file:kennel-replica-{os.getpid()}-{next(self._names)}"
+                   f"?mode=memory&cache=shared")
+            # The in-memory database lives as long as one connection to
+            # it is open, so the writer keeps it alive
+            writer = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            disk = sqlite3.connect(self.database, timeout=self.timeout)
+            try:
+                disk.backup(writer)
+            finally:
+                disk.close()
+
+            (old_pool, old_writer) = (self.pool, self._writer)
+            self.pool = ConnectionPool(uri, self.size, self.timeout,
+                                       read_only=True)
+            self._writer = writer
+
+        if old_pool is not None:
+            old_pool.close()
+            old_writer.close()
+
+    @contextmanager
+    def writing(self):
+        """ Holds off checks and reloads while writes are committed to the
+        file, then runs them on the copy.
+
+        Yields:
+            list: append (sql, rows, rowcount) for every statement
+                committed, with how many rows it changed in the file
+        """
+        statements = []
+        with self._lock:
+            yield statements
+            self.apply(statements)
+
+    def apply(self, statements):
+        """ Runs committed statements on the copy, and copies the file
+        again if they don't change the same rows they changed there """
+        try:
+            with self._reads.exclusive(), self._writer:
+                for (sql, rows, rowcount) in statements:
+                    changed = self._writer.executemany(sql, rows).rowcount
+                    if changed != rowcount:
+                        raise sqlite3.DatabaseError(
+                            f"{changed} rows changed, not {rowcount}: {sql}")
+        except sqlite3.DatabaseError as ex:
+            replica_log.warning("replica out of step with %s, copying it "
+                                "again: %s", self.database, ex)
+            self.load()
+
+    def reading(self):
+        """ Keeps writes from being applied for the length of a `with`
+        block, so what is read in it is the copy as of one commit """
+        return self._reads.shared()
+
+    def check(self):
+        """ Compares every row of every table in the copy with the file,
+        and copies the file again if any differ. The changed entities
+        get new ETags, since clients may hold copies of the old rows.
+
+        It reads the whole file, so run it now and then, not per request.
+
+        Returns:
+            dict: table -> the keys (rowid, or primary key of a table
+                without rowids) of the rows that differed, or None if the
+                file could not be read
+        """
+        with self._lock:
+            disk = sqlite3.connect(self.database, timeout=self.timeout)
+            try:
+                # Full-text indexes are left out: how their own tables lay
+                # out the same words depends on how writes were batched
+                tables = disk.execute(
+                    "SELECT name, sql FROM sqlite_master AS t "
+                    "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                    "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' "
+                    "AND NOT EXISTS (SELECT 1 FROM sqlite_master AS v "
+                    "WHERE v.sql LIKE 'CREATE VIRTUAL TABLE%' "
+                    "AND t.name LIKE v.name || '\\_%' ESCAPE '\\') "
+                    "ORDER BY name").fetchall()
+                differ = {}
+                for (table, create) in tables:
+                    keys = ["rowid"]
+                    if "WITHOUT ROWID" in create.upper():
+                        keys = [name for (_, name) in sorted(
+                            (pk, name) for (_, name, _, _, _, pk)
+                            in disk.execute(f"PRAGMA table_info({table})")
+                            if pk)]
+                    order = ", ".join(keys)
+                    sql = f"SELECT {order}, * FROM {table} ORDER BY {order}"
+                    changed = list(_changed_keys(
+                        self._writer.execute(sql), disk.execute(sql),
+                        len(keys)))
+                    if changed:
+                        differ[table] = changed
+            except sqlite3.OperationalError as ex:
+                replica_log.warning("could not check the replica: %s", ex)
+                return None
+            finally:
+                disk.close()
+
+            if differ:
+                replica_log.warning("replica differs from %s in %s, copying "
+                                    "it again", self.database,
+                                    ", ".join(differ))
+                self.load()
+
+        for entity in ENTITIES.values():
+            if entity.table in differ:
+                versions.bump_many(entity.resource,
+                                   [id for (id, ) in differ[entity.table]])
+        return differ
+
+    def close(self):
+        with self._lock:
+            self.pool.close()
+            self._writer.close()
+
+
+def _changed_keys(mine, theirs, width):
+    """ Yields the key of every row that is in only one of two cursors,
+    or in both with different values. Each row starts with its key,
+    `width` columns long, and both cursors are ordered by it. """
+    (a, b) = (next(mine, None), next(theirs, None))
+    while a is not None or b is not None:
+        if a is not None and b is not None and a[:width] == b[:width]:
+            if a != b:
+                yield a[:width]
+            (a, b) = (next(mine, None), next(theirs, None))
+        elif b is None or (a is not None and a[:width] < b[:width]):
+            yield a[:width]
+            a = next(mine, None)
+        else:
+            yield b[:width]
+            b = next(theirs, None)
+
+
+_settings = {"database": DATABASE_PATH, "size": 1, "replica": False}
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_replica = None
+_replica_pid = None
+
+
+def configure(database=None, size=None, replica=None):
+    """ Changes the settings used for the shared pool.
+
+    Call this before serving requests. Any pool that already exists is
+    closed and a new one is opened lazily on the next request.
+
+    Args:
+        replica (bool): serve reads from an in-memory Replica
+    """
+    global _pool, _replica
+
+    with _pool_lock:
+        if database is not None:
+            _settings["database"] = database
+        if size is not None:
+            _settings["size"] = max(1, size)
+        if replica is not None:
+            _settings["replica"] = replica
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+        if _replica is not None and _replica_pid == os.getpid():
+            _replica.close()
+        _replica = None
+
+
+def get_pool():
+    """ Returns the pool shared by this process """
+    global _pool, _pool_pid
+
+    # A forked worker process must never reuse its parent's connections,
+    # so the pool is rebuilt whenever the process id changes.
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(_settings["database"],
+                                       _settings["size"])
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_replica():
+    """ Returns the Replica of this process, loading it on first use, or
+    None when reads are served from the file """
+    global _replica, _replica_pid
+
+    if not _settings["replica"]:
+        return None
+    if _replica is None or _replica_pid != os.getpid():
+        with _pool_lock:
+            if _replica is None or _replica_pid != os.getpid():
+                _replica = Replica(_settings["database"], _settings["size"])
+                _replica_pid = os.getpid()
+    return _replica
+
+
+def connect():
+    """ Borrows a pooled connection: `with connect() as conn:` """
+    return get_pool().connection()
+
+
+@contextmanager
+def read(streaming=False):
+    """ Borrows a connection to read from: `with read() as conn:`. It is
+    the replica's when there is one, and the file's otherwise.
+
+    Everything read in the block sees the same commit. A block that
+    yields rows to a client as it reads them would hold off the replica's
+    writes for as long as the client takes, so it passes streaming=True
+    and reads each batch inside `with read_batch():` instead; each batch
+    then sees one commit, and later batches may see later ones.
+    """
+    replica = get_replica()
+    if replica is None:
+        with connect() as conn:
+            yield conn
+        return
+
+    with replica.pool.connection() as conn:
+        if streaming:
+            yield conn
+        else:
+            with replica.reading():
+                yield conn
+
+
+def read_batch():
+    """ Keeps the replica's writes out of one batch of a streaming read """
+    replica = get_replica()
+    if replica is None:
+        return nullcontext()
+    return replica.reading()
@@ -0,0 +1,66 @@
+class Entity():
+    """ Describes one table once, so the repository can write its SQL.
+
+    Args:
+        resource (str): the url name, e.g. "animals"
+        table (str): the table name, e.g. "Animal"
+        alias (str): the short name used for the table in queries
+        columns (tuple): every column except id, in the order they are
+            given in responses
+        body_keys (dict): column -> the key clients send it as in a
+            request body, for columns whose key differs from the name
+        relations (dict): name -> (related resource, foreign key column),
+            in the order they are given in responses
+        private (tuple): columns left out when the entity is expanded
+            into another resource's response
+        nullable (tuple): columns that may be null; every other one is
+            NOT NULL in the schema
+        search (tuple): columns in the full-text index the migrations
+            make for the table, named `<table>_search`, if any
+    """
+
+    def __init__(self, resource, table, alias, columns,
+                 body_keys=None, relations=None, private=(), search=(),
+                 nullable=()):
+        self.resource = resource
+        self.table = table
+        self.alias = alias
+        self.columns = columns
+        self.body_keys = body_keys or {}
+        self.relations = relations or {}
+        self.private = private
+        self.nullable = nullable
+        self.search = search
+        self.search_table = f"{table.lower()}_search" if search else None
+
+    def __repr__(self):
+        return f"Entity({self.resource!r})"
+
+
+LOCATION = Entity(
+    "locations", "Location", "l",
+    ("name", "address"))
+
+CUSTOMER = Entity(
+    "customers", "Customer", "c",
+    ("name", "address", "email", "password"),
+    private=("password",),
+    search=("name", "address"))
+
+EMPLOYEE = Entity(
+    "employees", "Employee", "e",
+    ("name", "address", "location_id"),
+    body_keys={"location_id": "locationId"},
+    relations={"location": ("locations", "location_id")})
+
+ANIMAL = Entity(
+    "animals", "Animal", "a",
+    ("name", "breed", "status", "location_id", "customer_id"),
+    body_keys={"location_id": "locationId", "customer_id": "customerId"},
+    relations={"location": ("locations", "location_id"),
+               "customer": ("customers", "customer_id")},
+    search=("name", "breed"),
+    nullable=("location_id",))
+
+ENTITIES = {entity.resource: entity
+            for entity in (ANIMAL, CUSTOMER, EMPLOYEE, LOCATION)}
@@ -0,0 +1,190 @@
+""" Bulk-loads rows into one table from a CSV or JSON lines file, such as
+one written by GET /export/<resource>.
+
+    python -m database.importer animals.jsonl --resource animals
+
+Rows are inserted a batch at a time, each batch in its own transaction,
+so a large file is never held in memory and a failure keeps the batches
+before it. The table's indexes are dropped for the load and built again
+once at the end, which is much faster than updating them row by row,
+and foreign keys are checked once at the end instead of per row. An
+import stopped before its indexes were rebuilt leaves them out until
+the next import or server start, which both make them again.
+
+A running server sees the rows in the changes table and gives them new
+ETags within a second.
+"""
+import argparse
+import csv
+import itertools
+import json
+import sqlite3
+import sys
+import time
+
+from .connection import DATABASE_PATH
+from . import versions
+from .entities import ENTITIES
+from .migrations import migrate
+from .repository import values_from
+
+# Rows inserted per transaction
+BATCH_SIZE = 5000
+
+
+def read_records(path, format):
+    """ Yields (line number, dictionary) for every record in a file
+
+    In a CSV file the first line names the columns, and an empty field
+    is NULL. A JSON lines file has one object per line.
+    """
+    with open(path, encoding="utf-8", newline="") as source:
+        if format == "csv":
+            reader = csv.DictReader(source)
+            for record in reader:
+                yield (reader.line_num,
+                       {key: (value if value != "" else None)
+                        for (key, value) in record.items()})
+        else:
+            for (number, line) in enumerate(source, start=1):
+                if line.strip():
+                    yield (number, json.loads(line))
+
+
+def row_from(entity, record):
+    """ The id, or None for a new one, followed by the column values
+
+    Raises:
+        ValueError: if the record is missing a column or has a bad id
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    id = record.get("id")
+    if id is not None:
+        id = int(id)
+    return [id] + values_from(entity, record)
+
+
+def secondary_indexes(conn, table):
+    """ (name, CREATE INDEX sql) for every index made on a table by a
+    migration, leaving out the ones SQLite makes for constraints """
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table, )).fetchall()
+
+
+def import_file(path, resource, format=None, database=DATABASE_PATH,
+                batch_size=BATCH_SIZE, keep_indexes=False):
+    """ Inserts every record in a file into a resource's table
+
+    Args:
+        path (str): the CSV or JSON lines file
+        resource (str): e.g. "animals"
+        format (str): "csv" or "jsonl"; guessed from the file name if None
+        database (str): path to the SQLite database file
+        batch_size (int): rows inserted per transaction
+        keep_indexes (bool): update the indexes row by row instead of
+            rebuilding them, which is faster when adding a few rows to a
+            large table
+
+    Returns:
+        tuple: (rows inserted, foreign key violations as
+            (table, rowid, referenced table) tuples)
+
+    Raises:
+        ValueError: naming the line of the first record that can't be
+            inserted; the batches before it stay inserted
+    """
+    # Makes the indexes a stopped import dropped again, so they are
+    # rebuilt at the end of this one
+    migrate(database)
+
+    entity = ENTITIES[resource]
+    format = format or ("csv" if path.endswith(".csv") else "jsonl")
+    columns = ", ".join(("id", ) + entity.columns)
+    placeholders = ", ".join("?" for _ in range(len(entity.columns) + 1))
+    sql = f"INSERT INTO {entity.table} ({columns}) VALUES ({placeholders})"
+
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    inserted = 0
+    try:
+        # Foreign keys are checked once, after the last batch
+        conn.execute("PRAGMA foreign_keys = OFF")
+
+        indexes = [] if keep_indexes else secondary_indexes(conn, entity.table)
+        for (name, _) in indexes:
+            conn.execute(f"DROP INDEX {name}")
+
+        try:
+            records = read_records(path, format)
+            while True:
+                batch = list(itertools.islice(records, batch_size))
+                if not batch:
+                    break
+
+                rows = []
+                for (number, record) in batch:
+                    try:
+                        rows.append(row_from(entity, record))
+                    except (TypeError, ValueError) as ex:
+                        raise ValueError(f"{path}:{number}: {ex}") from ex
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(sql, rows)
+                    conn.execute("COMMIT")
+                except sqlite3.Error as ex:
+                    conn.execute("ROLLBACK")
+                    raise ValueError(
+                        f"{path}: the batch starting at line {batch[0][0]} "
+                        f"was not inserted: {ex}") from ex
+                inserted += len(rows)
+        finally:
+            for (_, create) in indexes:
+                conn.execute(create)
+
+        violations = [(table, rowid, parent) for (table, rowid, parent, _)
+                      in conn.execute(
+                          f"PRAGMA foreign_key_check({entity.table})")]
+    finally:
+        conn.close()
+        # A failed import keeps the batches committed before it
+        if inserted:
+            versions.bump(resource)
+
+    return (inserted, violations)
+
+
+def main(argv=None):
+    """ Command line entry point: python -m database.importer """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("path", help="a .csv or .jsonl file")
+    parser.add_argument("--resource", required=True, choices=sorted(ENTITIES))
+    parser.add_argument("--format", choices=("csv", "jsonl"),
+                        help="by default, guessed from the file name")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="don't drop and rebuild the table's indexes")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        (inserted, violations) = import_file(
+            args.path, args.resource, args.format, args.database,
+            args.batch_size, args.keep_indexes)
+    except (OSError, ValueError) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    print(f"inserted {inserted} {args.resource} in {elapsed:.1f}s")
+    for (table, rowid, parent) in violations:
+        print(f"{table} {rowid} refers to a {parent} that doesn't exist",
+              file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
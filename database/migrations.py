@@ -0,0 +1,261 @@
+import argparse
+import sqlite3
+import sys
+
+from .connection import DATABASE_PATH, configure, get_pool
+
+
+def _change_triggers(table, resource):
+    """ Triggers that add a row to the changes table for every insert,
+    update and delete on a table """
+    return tuple(
+        f"CREATE TRIGGER {table.lower()}_changes_{event.lower()} "
+        f"AFTER {event} ON {table} BEGIN "
+        f"INSERT INTO changes (resource, entity_id, action) "
+        f"VALUES ('{resource}', {row}.id, '{action}'); END"
+        for (event, row, action) in (("INSERT", "new", "create"),
+                                     ("UPDATE", "new", "update"),
+                                     ("DELETE", "old", "delete")))
+
+
+# Every schema change ever made, in order. The database remembers how
+# many it has applied in PRAGMA user_version, so each one runs once.
+# Never edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    # 1: indexes for the filters and joins the views run on every request
+    (
+        "CREATE INDEX IF NOT EXISTS animal_location_id ON Animal (location_id)",
+        "CREATE INDEX IF NOT EXISTS animal_customer_id ON Animal (customer_id)",
+        "CREATE INDEX IF NOT EXISTS animal_status ON Animal (status)",
+        "CREATE INDEX IF NOT EXISTS employee_location_id ON Employee (location_id)",
+        "CREATE INDEX IF NOT EXISTS customer_email ON Customer (email)",
+    ),
+    # 2: full-text indexes for ?q= searches, kept up to date by triggers.
+    # The text itself stays in the tables; prefix indexes make searches
+    # for the first letters of a word as fast as for whole words.
+    (
+        "CREATE VIRTUAL TABLE animal_search USING fts5("
+        "name, breed, content='Animal', content_rowid='id', prefix='2 3')",
+        "CREATE TRIGGER animal_search_insert AFTER INSERT ON Animal BEGIN "
+        "INSERT INTO animal_search (rowid, name, breed) "
+        "VALUES (new.id, new.name, new.breed); END",
+        "CREATE TRIGGER animal_search_delete AFTER DELETE ON Animal BEGIN "
+        "INSERT INTO animal_search (animal_search, rowid, name, breed) "
+        "VALUES ('delete', old.id, old.name, old.breed); END",
+        "CREATE TRIGGER animal_search_update AFTER UPDATE ON Animal BEGIN "
+        "INSERT INTO animal_search (animal_search, rowid, name, breed) "
+        "VALUES ('delete', old.id, old.name, old.breed); "
+        "INSERT INTO animal_search (rowid, name, breed) "
+        "VALUES (new.id, new.name, new.breed); END",
+        "INSERT INTO animal_search (animal_search) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE customer_search USING fts5("
+        "name, address, content='Customer', content_rowid='id', prefix='2 3')",
+        "CREATE TRIGGER customer_search_insert AFTER INSERT ON Customer BEGIN "
+        "INSERT INTO customer_search (rowid, name, address) "
+        "VALUES (new.id, new.name, new.address); END",
+        "CREATE TRIGGER customer_search_delete AFTER DELETE ON Customer BEGIN "
+        "INSERT INTO customer_search (customer_search, rowid, name, address) "
+        "VALUES ('delete', old.id, old.name, old.address); END",
+        "CREATE TRIGGER customer_search_update AFTER UPDATE ON Customer BEGIN "
+        "INSERT INTO customer_search (customer_search, rowid, name, address) "
+        "VALUES ('delete', old.id, old.name, old.address); "
+        "INSERT INTO customer_search (rowid, name, address) "
+        "VALUES (new.id, new.name, new.address); END",
+        "INSERT INTO customer_search (customer_search) VALUES ('rebuild')",
+    ),
+    # 3: running counts of animals per location and status, and of
+    # employees per location, for /stats. Triggers keep them up to date,
+    # so reading them never counts the tables. Location 0 stands for
+    # animals with no location, since key columns can't be NULL.
+    (
+        "CREATE TABLE animal_stats (location_id INTEGER NOT NULL, "
+        "status TEXT NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (location_id, status)) WITHOUT ROWID",
+        "INSERT INTO animal_stats SELECT IFNULL(location_id, 0), status, "
+        "count(*) FROM Animal GROUP BY 1, 2",
+        "CREATE TRIGGER animal_stats_insert AFTER INSERT ON Animal BEGIN "
+        "INSERT INTO animal_stats "
+        "VALUES (IFNULL(new.location_id, 0), new.status, 1) "
+        "ON CONFLICT (location_id, status) DO UPDATE SET count = count + 1; "
+        "END",
+        "CREATE TRIGGER animal_stats_delete AFTER DELETE ON Animal BEGIN "
+        "UPDATE animal_stats SET count = count - 1 "
+        "WHERE location_id = IFNULL(old.location_id, 0) "
+        "AND status = old.status; END",
+        "CREATE TRIGGER animal_stats_update "
+        "AFTER UPDATE OF location_id, status ON Animal "
+        "WHEN old.location_id IS NOT new.location_id "
+        "OR old.status IS NOT new.status BEGIN "
+        "UPDATE animal_stats SET count = count - 1 "
+        "WHERE location_id = IFNULL(old.location_id, 0) "
+        "AND status = old.status; "
+        "INSERT INTO animal_stats "
+        "VALUES (IFNULL(new.location_id, 0), new.status, 1) "
+        "ON CONFLICT (location_id, status) DO UPDATE SET count = count + 1; "
+        "END",
+
+        "CREATE TABLE employee_stats (location_id INTEGER NOT NULL "
+        "PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID",
+        "INSERT INTO employee_stats SELECT location_id, count(*) "
+        "FROM Employee GROUP BY 1",
+        "CREATE TRIGGER employee_stats_insert AFTER INSERT ON Employee BEGIN "
+        "INSERT INTO employee_stats VALUES (new.location_id, 1) "
+        "ON CONFLICT (location_id) DO UPDATE SET count = count + 1; END",
+        "CREATE TRIGGER employee_stats_delete AFTER DELETE ON Employee BEGIN "
+        "UPDATE employee_stats SET count = count - 1 "
+        "WHERE location_id = old.location_id; END",
+        "CREATE TRIGGER employee_stats_update "
+        "AFTER UPDATE OF location_id ON Employee "
+        "WHEN old.location_id IS NOT new.location_id BEGIN "
+        "UPDATE employee_stats SET count = count - 1 "
+        "WHERE location_id = old.location_id; "
+        "INSERT INTO employee_stats VALUES (new.location_id, 1) "
+        "ON CONFLICT (location_id) DO UPDATE SET count = count + 1; END",
+    ),
+    # 4: a log of every create, update and delete for the /changes feed.
+    # AUTOINCREMENT keeps ids from ever being reused, so a client can
+    # resume from the last one it saw; only the newest 100000 are kept.
+    (
+        "CREATE TABLE changes (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "resource TEXT NOT NULL, entity_id INTEGER NOT NULL, "
+        "action TEXT NOT NULL)",
+        "CREATE TRIGGER changes_prune AFTER INSERT ON changes "
+        "WHEN new.id % 1000 = 0 BEGIN "
+        "DELETE FROM changes WHERE id <= new.id - 100000; END",
+    )
+    + _change_triggers("Animal", "animals")
+    + _change_triggers("Customer", "customers")
+    + _change_triggers("Employee", "employees")
+    + _change_triggers("Location", "locations"),
+]
+
+
+def schema_version(conn):
+    """ How many migrations the database has had applied """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def restore_indexes(conn, version):
+    """ Creates again any index made by the first `version` migrations
+    that has since been dropped, as database.importer does for the length
+    of a load; one stopped before it could rebuild them leaves them out """
+    for statements in MIGRATIONS[:version]:
+        for statement in statements:
+            if statement.startswith("CREATE INDEX IF NOT EXISTS"):
+                conn.execute(statement)
+
+
+def migrate(database=DATABASE_PATH):
+    """ Applies every migration the database has not had yet, and makes
+    any index an earlier one made again if it is missing.
+
+    All of them run in one write transaction, so two processes starting
+    at once can't both apply the same migration.
+
+    Args:
+        database (str): path to the SQLite database file
+
+    Returns:
+        int: the schema version the database is now at
+    """
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            for (number, statements) in enumerate(MIGRATIONS, start=1):
+                if number <= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+                version = number
+            restore_indexes(conn, version)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+    finally:
+        conn.close()
+
+
+def check_query_plans(database=DATABASE_PATH):
+    """ Runs the filtered and joined view queries and asks SQLite how it
+    would execute each one, to prove none of them scans a whole table.
+
+    The SQL is captured from the view functions themselves, so the check
+    always covers what the server really runs. Whole lists are fetched a
+    page at a time, which is how large tables should be read.
+
+    Returns:
+        list: (sql, plan detail) for every step that scans a table;
+            empty when every query is served by an index
+    """
+    # The views import this package, so they are imported late
+    import views
+
+    configure(database=database, size=1)
+    pool = get_pool()
+
+    executed = []
+    conn = pool.acquire()
+    conn.set_trace_callback(executed.append)
+    pool.release(conn)
+
+    try:
+        views.get_all_animals(10, 0, ("location", "customer"))
+        views.get_all_employees(10, 0, ("location",))
+        views.get_animal_by_location(1, 10)
+        views.get_animal_by_status("Kennel", 10)
+        views.get_employee_by_location(1, 10)
+        views.get_customer_by_email("someone@example.com", 10)
+        views.search_animals("bea", 10, expand=("location",))
+        views.search_customers("main", 10)
+    finally:
+        conn = pool.acquire()
+        conn.set_trace_callback(None)
+        pool.release(conn)
+
+    scans = []
+    with pool.connection() as conn:
+        for sql in executed:
+            if not sql.lstrip().upper().startswith("SELECT"):
+                continue
+            # The full-text index's own reads of its settings
+            if "'main'." in sql:
+                continue
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+                detail = row[3]
+                # A full-text MATCH shows as a scan of the virtual table,
+                # but it is answered from the full-text index
+                if detail.startswith("SCAN") and "USING" not in detail \
+                        and "VIRTUAL TABLE INDEX" not in detail:
+                    scans.append((" ".join(sql.split()), detail))
+    return scans
+
+
+def main(argv=None):
+    """ Command line entry point: python -m database.migrations """
+    parser = argparse.ArgumentParser(
+        description="Bring the kennel database schema up to date")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--check", action="store_true",
+                        help="fail if any view query scans a whole table")
+    args = parser.parse_args(argv)
+
+    version = migrate(args.database)
+    print(f"{args.database} is at schema version {version}")
+
+    if args.check:
+        scans = check_query_plans(args.database)
+        for (sql, detail) in scans:
+            print(f"{detail}: {sql}", file=sys.stderr)
+        if scans:
+            return 1
+        print("every view query uses an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# No page may be larger than this, whatever the client asks for
+MAX_PAGE_SIZE = 1000
+
+
+def keyset_page(alias, limit=None, after=None, where=None):
+    """ Builds the tail of a SELECT that returns one page of rows ordered
+    by id, starting just after the `after` cursor.
+
+    Seeking on the primary key means every page costs the same, however
+    deep into the table it is, unlike LIMIT/OFFSET.
+
+    Args:
+        alias (str): the table alias whose id is the cursor, e.g. "a"
+        limit (int): the most rows to return, or None for every row
+        after (int): the last id the client already has, or None
+        where (list): (condition, value) pairs the rows must also match;
+            the value is a list for a condition with several placeholders
+
+    Returns:
+        tuple: the SQL clause and the list of parameters it needs
+    """
+    conditions = []
+    params = []
+
+    for condition, value in where or []:
+        conditions.append(condition)
+        if isinstance(value, (list, tuple)):
+            params.extend(value)
+        else:
+            params.append(value)
+
+    if after is not None:
+        conditions.append(f"{alias}.id > ?")
+        params.append(after)
+
+    clause = ""
+    if conditions:
+        clause = "WHERE " + " AND ".join(conditions)
+
+    clause += f" ORDER BY {alias}.id"
+
+    if limit is not None:
+        clause += " LIMIT ?"
+        params.append(min(limit, MAX_PAGE_SIZE))
+
+    return clause, params
@@ -0,0 +1,529 @@
+import functools
+import json
+import re
+
+from . import versions
+from .connection import read, read_batch
+from .writer import write
+from .entities import ENTITIES
+from .pagination import MAX_PAGE_SIZE, keyset_page
+
+# SQL text is generated once per entity and reused, so the statement
+# cache every pooled connection keeps (keyed on the SQL text) hands back
+# an already prepared statement instead of parsing it again.
+
+# Rows encoded per call to the JSON encoder when streaming
+ENCODE_BATCH_SIZE = 256
+
+# Search results returned when no limit is asked for
+DEFAULT_SEARCH_LIMIT = 20
+
+# Bound parameters per statement; older SQLite builds allow no more
+# than 999
+MAX_PARAMETERS = 500
+
+
+@functools.lru_cache(maxsize=None)
+def select_sql(entity, joins=()):
+    """ SELECT ... FROM ... for an entity and any relations joined in.
+
+    Joined columns are named `<relation>__<column>`.
+    """
+    alias = entity.alias
+    columns = [f"{alias}.id"] + [f"{alias}.{column}"
+                                 for column in entity.columns]
+    tables = [f"{entity.table} {alias}"]
+
+    for name in joins:
+        (resource, foreign_key) = entity.relations[name]
+        related = ENTITIES[resource]
+        columns += [f"{name}.{column} AS {name}__{column}"
+                    for column in ("id",) + related.columns]
+        tables.append(
+            f"JOIN {related.table} {name} ON {name}.id = {alias}.{foreign_key}")
+
+    return f"SELECT {', '.join(columns)} FROM {' '.join(tables)}"
+
+
+@functools.lru_cache(maxsize=None)
+def insert_sql(entity):
+    """ INSERT for every column but id """
+    placeholders = ", ".join("?" for _ in entity.columns)
+    return (f"INSERT INTO {entity.table} ({', '.join(entity.columns)}) "
+            f"VALUES ({placeholders})")
+
+
+@functools.lru_cache(maxsize=None)
+def insert_with_id_sql(entity):
+    """ INSERT for every column, with the id last, to repeat an insert on
+    the replica with the id the file gave it """
+    placeholders = ", ".join("?" for _ in entity.columns)
+    return (f"INSERT INTO {entity.table} ({', '.join(entity.columns)}, id) "
+            f"VALUES ({placeholders}, ?)")
+
+
+@functools.lru_cache(maxsize=None)
+def update_sql(entity):
+    """ UPDATE of every column but id, for one id """
+    assignments = ", ".join(f"{column} = ?" for column in entity.columns)
+    return f"UPDATE {entity.table} SET {assignments} WHERE id = ?"
+
+
+@functools.lru_cache(maxsize=None)
+def delete_sql(entity):
+    """ DELETE of one id """
+    return f"DELETE FROM {entity.table} WHERE id = ?"
+
+
+@functools.lru_cache(maxsize=None)
+def row_mapper(entity, joins=()):
+    """ Makes a function that turns a plain tuple row from select_sql
+    straight into the dictionary sent for it: id, the columns and then
+    the relations, in the entity's order.
+
+    Relations that were not joined are None.
+    """
+    fields = ("id",) + entity.columns
+
+    # Where each joined relation's columns sit in the row
+    spans = {}
+    start = len(fields)
+    for name in joins:
+        related = ENTITIES[entity.relations[name][0]]
+        related_fields = ("id",) + related.columns
+        spans[name] = (related_fields, start, start + len(related_fields))
+        start += len(related_fields)
+
+    relations = [(name,) + spans.get(name, (None, 0, 0))
+                 for name in entity.relations]
+
+    def to_dict(row):
+        result = dict(zip(fields, row))
+        for (name, keys, begin, end) in relations:
+            result[name] = dict(zip(keys, row[begin:end])) if keys else None
+        return result
+
+    return to_dict
+
+
+def values_from(entity, body):
+    """ Pulls the column values out of a request body, in column order.
+
+    Raises:
+        ValueError: if the body is not an object, is missing any column,
+            or has a null for a NOT NULL column or a value that isn't a
+            string or number
+    """
+    if not isinstance(body, dict):
+        raise ValueError(f"send {entity.resource} as JSON objects")
+
+    values = []
+    missing = []
+    bad = []
+
+    for column in entity.columns:
+        key = entity.body_keys.get(column, column)
+        if key in body:
+            value = body[key]
+        elif column in body:
+            value = body[column]
+        else:
+            missing.append(key)
+            continue
+
+        if value is None and column not in entity.nullable:
+            bad.append(f"{key} can't be null")
+        elif value is not None and not isinstance(value, (str, int, float)):
+            bad.append(f"{key} must be a string or a number")
+        values.append(value)
+
+    if missing:
+        bad.insert(0, f"{entity.resource} need {', '.join(missing)}")
+    if bad:
+        raise ValueError(", ".join(bad))
+    return values
+
+
+def values_from_each(entity, bodies, with_id=False):
+    """ Pulls the column values out of every body in a bulk request before
+    any of them is written, so one bad body rejects the whole batch.
+
+    Args:
+        with_id (bool): each body must also carry its "id", which is
+            added as the last value
+
+    Raises:
+        ValueError: naming the position of every body that is not valid
+    """
+    if not isinstance(bodies, list) or not bodies:
+        raise ValueError(f"send a non-empty list of {entity.resource}")
+
+    rows = []
+    problems = []
+
+    for (index, body) in enumerate(bodies):
+        try:
+            values = values_from(entity, body)
+            if with_id:
+                if not isinstance(body.get("id"), int):
+                    raise ValueError("needs an id")
+                values.append(body["id"])
+            rows.append(values)
+        except ValueError as ex:
+            problems.append(f"[{index}] {ex}")
+
+    if problems:
+        raise ValueError("; ".join(problems))
+    return rows
+
+
+def check_expand(entity, expand):
+    """ Makes sure every relation asked to be expanded exists
+
+    Raises:
+        ValueError: naming the first one that doesn't
+    """
+    for name in expand:
+        if name not in entity.relations:
+            raise ValueError(f"{entity.resource} have no {name} to expand")
+    return tuple(expand)
+
+
+def _rows_by_id(db_cursor, entity, ids, joins=()):
+    """ id -> dictionary for every id that exists, with one query per
+    MAX_PARAMETERS ids """
+    to_dict = row_mapper(entity, joins)
+    ids = list(ids)
+    found = {}
+
+    for start in range(0, len(ids), MAX_PARAMETERS):
+        chunk = ids[start:start + MAX_PARAMETERS]
+        placeholders = ", ".join("?" for _ in chunk)
+        db_cursor.execute(
+            f"{select_sql(entity, joins)} "
+            f"WHERE {entity.alias}.id IN ({placeholders})", chunk)
+        for row in db_cursor.fetchall():
+            found[row[0]] = to_dict(row)
+
+    return found
+
+
+def _attach(conn, entity, rows, expand):
+    """ Loads each expanded relation of a batch of rows with one query,
+    asking for every distinct id the batch refers to only once, and sets
+    it on each row. Private columns are left out of what is attached.
+    """
+    db_cursor = conn.cursor()
+    db_cursor.row_factory = None
+
+    for name in expand:
+        (resource, foreign_key) = entity.relations[name]
+        related = ENTITIES[resource]
+
+        ids = {row[foreign_key] for row in rows
+               if row[foreign_key] is not None}
+        found = _rows_by_id(db_cursor, related, ids)
+        for related_row in found.values():
+            for column in related.private:
+                del related_row[column]
+
+        for row in rows:
+            row[name] = found.get(row[foreign_key])
+
+
+def _conditions(entity, filters):
+    """ (condition, value) pairs for keyset_page, one per filter
+
+    Raises:
+        ValueError: for a filter column the entity doesn't have
+    """
+    # Every filter becomes one condition of a single WHERE clause, with
+    # the values bound as parameters
+    where = []
+    for (column, value) in (filters or {}).items():
+        if column != "id" and column not in entity.columns:
+            raise ValueError(f"{entity.resource} have no {column}")
+        if isinstance(value, (list, tuple)) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, (list, tuple)):
+            placeholders = ", ".join("?" for _ in value)
+            where.append(
+                (f"{entity.alias}.{column} IN ({placeholders})", value))
+        else:
+            where.append((f"{entity.alias}.{column} = ?", value))
+    return where
+
+
+def iter_rows(entity, limit=None, after=None, filters=None, joins=(),
+              expand=(), encoded=False):
+    """ Yields the entity's rows as dictionaries, in id order
+
+    Bad filters or relations raise here rather than once the rows are
+    being read.
+
+    Args:
+        entity (Entity): what to select
+        limit (int): the most rows to return, all of them if None
+        after (int): only return rows whose id is greater than this
+        filters (dict): column -> the value the rows must be equal to,
+            or a list of values they must be one of
+        joins (tuple): relations to join in and attach to each row
+        expand (tuple): relations to load separately, a batch of rows at
+            a time, and attach to each row
+        encoded (bool): yield JSON text instead, several rows at a time,
+            separated by ", " so the pieces can be joined into an array
+
+    Raises:
+        ValueError: for a filter column or relation the entity doesn't have
+    """
+    where = _conditions(entity, filters)
+    expand = check_expand(entity, expand)
+    (page, params) = keyset_page(entity.alias, limit, after, where)
+
+    return _iter_rows(entity, f"{select_sql(entity, joins)} {page}", params,
+                      joins, expand, encoded)
+
+
+def _iter_rows(entity, sql, params, joins, expand, encoded):
+    to_dict = row_mapper(entity, joins)
+    encode = json.JSONEncoder().encode
+
+    with read(streaming=True) as conn:
+        db_cursor = conn.cursor()
+
+        # Plain tuples are all row_mapper needs, and the cheapest rows
+        # sqlite3 can make
+        db_cursor.row_factory = None
+        with read_batch():
+            db_cursor.execute(sql, params)
+
+        while True:
+            with read_batch():
+                rows = db_cursor.fetchmany(ENCODE_BATCH_SIZE)
+                if not rows:
+                    break
+
+                rows = [to_dict(row) for row in rows]
+                if expand:
+                    _attach(conn, entity, rows, expand)
+
+            if encoded:
+                # One call to the C encoder for the whole batch, with the
+                # array brackets around it dropped
+                yield encode(rows)[1:-1]
+            else:
+                yield from rows
+
+
+def match_query(text):
+    """ Turns what someone typed into an FTS5 query that matches rows
+    containing every word, each as the start of a word, so "bea lab"
+    finds a Beagle named Labby. Quoting each word keeps FTS5 syntax such
+    as AND, NEAR or column: from being read out of the text.
+
+    Returns:
+        str: the query, or None if the text has no words in it
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_rows(entity, text, limit=DEFAULT_SEARCH_LIMIT, offset=0,
+                filters=None, expand=()):
+    """ The entity's rows that match a search, best match first
+
+    Every match has to be scored before the best ones are known, so
+    pages are taken with an offset into the ranked matches rather than
+    a cursor.
+
+    Args:
+        entity (Entity): what to search; it must have a search index
+        text (str): the words to look for
+        limit (int): the most rows to return, at most MAX_PAGE_SIZE
+        offset (int): how many of the best matches to skip
+        filters (dict): as for iter_rows
+        expand (tuple): relations to attach to each row
+
+    Raises:
+        ValueError: for a resource that can't be searched, or a bad filter
+            or relation
+    """
+    if not entity.search:
+        raise ValueError(f"{entity.resource} can't be searched")
+    where = _conditions(entity, filters)
+    expand = check_expand(entity, expand)
+
+    query = match_query(text)
+    if query is None:
+        return []
+
+    fts = entity.search_table
+    conditions = [f"{fts} MATCH ?"]
+    params = [query]
+    for (condition, value) in where:
+        conditions.append(condition)
+        params.extend(value if isinstance(value, (list, tuple)) else [value])
+
+    with read() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+        # Best first, by bm25, and in id order among equally good matches
+        db_cursor.execute(
+            f"{select_sql(entity)} "
+            f"JOIN {fts} ON {fts}.rowid = {entity.alias}.id "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {fts}.rank, {entity.alias}.id LIMIT ? OFFSET ?",
+            params + [min(limit, MAX_PAGE_SIZE), offset])
+
+        to_dict = row_mapper(entity)
+        rows = [to_dict(row) for row in db_cursor.fetchall()]
+        if expand:
+            _attach(conn, entity, rows, expand)
+
+    return rows
+
+
+def get_row(entity, id, joins=(), expand=()):
+    """ The dictionary for one id, or None if there is no such row """
+    expand = check_expand(entity, expand)
+
+    with read() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+        row = db_cursor.execute(
+            f"{select_sql(entity, joins)} WHERE {entity.alias}.id = ?",
+            (id, )).fetchone()
+
+        if row is None:
+            return None
+
+        row = row_mapper(entity, joins)(row)
+        if expand:
+            _attach(conn, entity, [row], expand)
+
+    return row
+
+
+def get_rows(entity, ids, joins=(), expand=()):
+    """ The dictionaries for a list of ids, fetched with as few queries as
+    the parameter limit allows
+
+    Returns:
+        tuple: (the rows in the same order as ids, repeated where an id
+            is, and the ids that don't exist)
+    """
+    expand = check_expand(entity, expand)
+    unique = list(dict.fromkeys(ids))
+
+    with read() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+        found = _rows_by_id(db_cursor, entity, unique, joins)
+
+        if expand:
+            _attach(conn, entity, list(found.values()), expand)
+
+    rows = [found[id] for id in ids if id in found]
+    missing = [id for id in unique if id not in found]
+    return (rows, missing)
+
+
+def insert(entity, body):
+    """ Inserts a row from a request body and returns its new id """
+    values = values_from(entity, body)
+
+    def run(conn, replicate):
+        id = conn.execute(insert_sql(entity), values).lastrowid
+        replicate(insert_with_id_sql(entity), [values + [id]], 1)
+        return id
+
+    id = write(run)
+    versions.bump(entity.resource, id)
+    return id
+
+
+def insert_many(entity, bodies):
+    """ Inserts every body in one transaction and returns their new ids,
+    in the same order """
+    rows = values_from_each(entity, bodies)
+
+    def run(conn, replicate):
+        conn.executemany(insert_sql(entity), rows)
+
+        # The writer is the only one inserting while it holds the write
+        # lock, so the new ids run up to the last one without gaps
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids = list(range(last_id - len(rows) + 1, last_id + 1))
+        replicate(insert_with_id_sql(entity),
+                  [row + [id] for (row, id) in zip(rows, ids)], len(rows))
+        return ids
+
+    ids = write(run)
+    versions.bump_many(entity.resource, ids)
+    return ids
+
+
+def update_many(entity, bodies):
+    """ Replaces every body's row in one transaction.
+
+    Nothing is changed unless every id exists.
+
+    Returns:
+        list: the ids that don't exist; empty when everything was updated
+    """
+    rows = values_from_each(entity, bodies, with_id=True)
+    ids = [row[-1] for row in rows]
+
+    def run(conn, replicate):
+        found = set()
+        for start in range(0, len(ids), MAX_PARAMETERS):
+            chunk = ids[start:start + MAX_PARAMETERS]
+            placeholders = ", ".join("?" for _ in chunk)
+            found.update(id for (id, ) in conn.execute(
+                f"SELECT id FROM {entity.table} WHERE id IN ({placeholders})",
+                chunk).fetchall())
+
+        missing = [id for id in ids if id not in found]
+        if missing:
+            return missing
+
+        rows_affected = conn.executemany(update_sql(entity), rows).rowcount
+        replicate(update_sql(entity), rows, rows_affected)
+        return []
+
+    missing = write(run)
+    if not missing:
+        versions.bump_many(entity.resource, ids)
+    return missing
+
+
+def update(entity, id, body):
+    """ Replaces a row from a request body. False if the id doesn't exist """
+    values = values_from(entity, body)
+
+    def run(conn, replicate):
+        rows_affected = conn.execute(update_sql(entity), values + [id]).rowcount
+        replicate(update_sql(entity), [values + [id]], rows_affected)
+        return rows_affected
+
+    rows_affected = write(run)
+    # A missing id changes nothing, so cached copies are still current
+    if rows_affected > 0:
+        versions.bump(entity.resource, id)
+    return rows_affected > 0
+
+
+def delete(entity, id):
+    """ Deletes a row. False if the id doesn't exist """
+    def run(conn, replicate):
+        rows_affected = conn.execute(delete_sql(entity), (id, )).rowcount
+        replicate(delete_sql(entity), [(id, )], rows_affected)
+        return rows_affected
+
+    rows_affected = write(run)
+    # A missing id changes nothing, so cached copies are still current
+    if rows_affected > 0:
+        versions.bump(entity.resource, id)
+    return rows_affected > 0
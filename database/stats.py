@@ -0,0 +1,60 @@
+from .connection import read
+
+
+def get_stats():
+    """ How many animals each location has in each status, and how many
+    employees each location has.
+
+    The counts come from the tables the triggers of migration 3 keep up
+    to date, so this reads one row per location and status however many
+    animals and employees there are.
+
+    Returns:
+        dict: {"animals": {"total", "statuses", "locations"},
+               "employees": {"total", "locations"}}, where each location
+            is {"location_id", "name", "total"} and, for animals,
+            "statuses": status -> count
+    """
+    with read() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = None
+
+        animal_rows = db_cursor.execute("""
+            SELECT s.location_id, l.name, s.status, s.count
+            FROM animal_stats s
+            LEFT JOIN Location l ON l.id = s.location_id
+            WHERE s.count > 0
+            ORDER BY s.location_id, s.status
+            """).fetchall()
+
+        employee_rows = db_cursor.execute("""
+            SELECT s.location_id, l.name, s.count
+            FROM employee_stats s
+            LEFT JOIN Location l ON l.id = s.location_id
+            WHERE s.count > 0
+            ORDER BY s.location_id
+            """).fetchall()
+
+    animals = {"total": 0, "statuses": {}, "locations": []}
+    locations = {}
+    for (location_id, name, status, count) in animal_rows:
+        location = locations.get(location_id)
+        if location is None:
+            # Location 0 holds the animals that have no location
+            location = locations[location_id] = {
+                "location_id": location_id or None, "name": name,
+                "total": 0, "statuses": {}}
+            animals["locations"].append(location)
+        location["statuses"][status] = count
+        location["total"] += count
+        animals["statuses"][status] = animals["statuses"].get(status, 0) \
+            + count
+        animals["total"] += count
+
+    employees = {"total": 0, "locations": []}
+    for (location_id, name, count) in employee_rows:
+        employees["locations"].append(
+            {"location_id": location_id, "name": name, "total": count})
+        employees["total"] += count
+
+    return {"animals": animals, "employees": employees}
@@ -0,0 +1,83 @@
+import multiprocessing
+import time
+
+# Each resource's list also shows data from the resources listed here,
+# so a change to any of them changes the list's ETag
+DEPENDENCIES = {
+    "animals": ("animals", "locations", "customers"),
+    "customers": ("customers",),
+    "employees": ("employees", "locations"),
+    "locations": ("locations",),
+    "stats": ("animals", "employees", "locations"),
+}
+
+RESOURCES = ("animals", "customers", "employees", "locations")
+
+# Entities share this many counters. Two entities landing on the same
+# counter only means one of them is re-sent when it did not need to be.
+ENTITY_SLOTS = 4096
+
+# Changes whenever the server restarts, so clients never match an ETag
+# handed out by an earlier run whose counters started from zero too
+_EPOCH = format(int(time.time() * 1000), "x")
+
+# The counters live in shared memory created before any worker is
+# forked, so a write in one pre-fork worker is seen by all of them
+_versions = multiprocessing.Array("q", len(RESOURCES) + ENTITY_SLOTS)
+
+
+def _entity_slot(resource, id):
+    return len(RESOURCES) + \
+        (RESOURCES.index(resource) * 1000003 + int(id)) % ENTITY_SLOTS
+
+
+def bump(resource, id=None):
+    """ Records that a resource changed, and which entity if known
+
+    Args:
+        resource (str): e.g. "animals"
+        id (int): the primary key of the entity that changed
+    """
+    with _versions.get_lock():
+        _versions[RESOURCES.index(resource)] += 1
+        if id is not None:
+            _versions[_entity_slot(resource, id)] += 1
+
+
+def bump_many(resource, ids):
+    """ Records that several entities of a resource changed at once """
+    with _versions.get_lock():
+        _versions[RESOURCES.index(resource)] += 1
+        for id in ids:
+            _versions[_entity_slot(resource, id)] += 1
+
+
+def bump_all():
+    """ Records that anything may have changed, when what did is unknown """
+    with _versions.get_lock():
+        for index in range(len(_versions)):
+            _versions[index] += 1
+
+
+def current():
+    """ Every resource's counter, to notice when anything has changed """
+    return tuple(_versions[:len(RESOURCES)])
+
+
+def collection_etag(resource):
+    """ The ETag for any list of a resource, or None if it is unknown """
+    if resource not in DEPENDENCIES:
+        return None
+
+    parts = [str(_versions[RESOURCES.index(dependency)])
+             for dependency in DEPENDENCIES[resource]]
+    return f'"{_EPOCH}-{resource}-{".".join(parts)}"'
+
+
+def entity_etag(resource, id):
+    """ The ETag for a single entity, or None if it is unknown """
+    if resource not in DEPENDENCIES:
+        return None
+
+    version = _versions[_entity_slot(resource, id)]
+    return f'"{_EPOCH}-{resource}-{id}-{version}"'
@@ -0,0 +1,211 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from telemetry import add_sql_time, sql_time, start_request
+
+from .connection import ConnectionPool, _settings, get_replica
+
+# The most writes committed in one transaction
+MAX_BATCH = 256
+
+# Seconds a request waits for its write to be committed
+SUBMIT_TIMEOUT = 60
+
+writer_log = logging.getLogger("kennel.writer")
+
+
+class _Pending():
+    """ One write waiting for the writer, and what came of it """
+
+    def __init__(self, job):
+        self.job = job
+        self.result = None
+        self.error = None
+        # Time spent in SQLite on it, including its share of the commit
+        self.sql_seconds = 0.0
+        self.abandoned = False
+        self.done = threading.Event()
+
+
+class Writer():
+    """ The one thread in a process that writes to the database file.
+
+    Request threads hand it their writes and wait. It takes every write
+    that is waiting, runs them one after another in a single transaction
+    and commits them together, so concurrent writes share one commit
+    instead of queueing for the file's write lock and syncing it once
+    each. Each write runs inside its own savepoint, so one that fails is
+    undone and reported to its own request without affecting the rest.
+
+    Args:
+        database (str): path to the SQLite database file
+        timeout (float): seconds to wait for another process's write lock
+        max_batch (int): the most writes to commit at once
+        submit_timeout (float): seconds submit() waits for a commit
+    """
+
+    def __init__(self, database, timeout=30, max_batch=MAX_BATCH,
+                 submit_timeout=SUBMIT_TIMEOUT):
+        self.database = database
+        self.max_batch = max_batch
+        self.submit_timeout = submit_timeout
+        self._conn = ConnectionPool(database, 1, timeout).acquire()
+        # Transactions are begun and committed here, not by sqlite3
+        self._conn.isolation_level = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_forever,
+                                        name="writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        """ Runs job(conn, replicate) in the next group commit.
+
+        replicate(sql, rows, rowcount) records a statement to repeat on
+        the replica, with how many rows it changed.
+
+        Returns:
+            what job returned, once it is committed
+
+        Raises:
+            whatever job raised, or the error that stopped the commit;
+            sqlite3.OperationalError if it isn't committed within
+            submit_timeout, in which case it is not run if it hasn't
+            started yet
+        """
+        pending = _Pending(job)
+        self._queue.put(pending)
+        if not pending.done.wait(self.submit_timeout):
+            pending.abandoned = True
+            raise sqlite3.OperationalError(
+                "timed out waiting for the write to be committed")
+        # The SQL ran on the writer's thread, but the request waited for
+        # it, so the time is counted for the request
+        add_sql_time(pending.sql_seconds)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """ Stops the thread once the writes already handed to it are
+        committed """
+        self._queue.put(None)
+
+    def is_alive(self):
+        """ Whether the thread is still taking writes """
+        return self._thread.is_alive()
+
+    def _write_forever(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+
+            # Writes given up on while they waited are left out
+            batch = [pending for pending in batch if not pending.abandoned]
+            try:
+                if batch:
+                    self._commit(batch)
+            except Exception as ex:
+                # Such as the replica failing to apply the batch; the
+                # thread carries on with the next one
+                writer_log.exception("write batch failed")
+                for pending in batch:
+                    (pending.result, pending.error) = (None, ex)
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+            if stop:
+                self._conn.close()
+                return
+
+    def _commit(self, batch):
+        conn = self._conn
+        replica = get_replica()
+
+        with _replicating(replica) as statements:
+            try:
+                start_request()
+                conn.execute("BEGIN IMMEDIATE")
+                shared = sql_time()
+                for pending in batch:
+                    mine = []
+                    start_request()
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        pending.result = pending.job(
+                            conn, lambda sql, rows, rowcount:
+                            mine.append((sql, rows, rowcount)))
+                    except Exception as ex:
+                        conn.execute("ROLLBACK TO write")
+                        pending.error = ex
+                    conn.execute("RELEASE write")
+                    pending.sql_seconds = sql_time()
+                    statements.extend(mine)
+                start_request()
+                conn.execute("COMMIT")
+                # Every write in the batch waited for the whole commit
+                shared += sql_time()
+                for pending in batch:
+                    pending.sql_seconds += shared
+            except Exception as ex:
+                # Nothing in the batch was written
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                for pending in batch:
+                    (pending.result, pending.error) = (None, ex)
+                del statements[:]
+
+
+@contextmanager
+def _replicating(replica):
+    """ The replica's writing() when there is one, otherwise a list that
+    is thrown away """
+    if replica is None:
+        yield []
+        return
+    with replica.writing() as statements:
+        yield statements
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """ Returns the writer of this process, starting it on first use """
+    global _writer, _writer_pid
+
+    # A forked worker doesn't inherit its parent's thread, configure()
+    # may have pointed the pool at another file, and a writer may have
+    # been closed or have died
+    if _writer is None or _writer_pid != os.getpid() \
+            or _writer.database != _settings["database"] \
+            or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is not None and _writer_pid == os.getpid() \
+                    and _writer.database != _settings["database"]:
+                _writer.close()
+                _writer = None
+            if _writer is None or _writer_pid != os.getpid() \
+                    or not _writer.is_alive():
+                _writer = Writer(_settings["database"])
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def write(job):
+    """ Runs job(conn, replicate) on the writer and returns its result """
+    return get_writer().submit(job)
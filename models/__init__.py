@@ -2,3 +2,4 @@ from .animal import Animal
 from .location import Location
 from .employee import Employee
 from .customer import Customer
+from .model import Model
@@ -1,7 +1,14 @@
-class Animal():
+from .model import Model
+
+
+class Animal(Model):
     """ Class initializer. It has 5 custom parameters, with the
      special `self` parameter that every method on a class
      needs as the first parameter. """
+
+    __slots__ = ('id', 'name', 'breed', 'status', 'location_id',
+                 'customer_id', 'location', 'customer')
+
     def __init__(self, id, name, breed, status, customer_id, location_id):
         self.id = id
         self.name = name
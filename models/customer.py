@@ -1,8 +1,13 @@
-class Customer():
+from .model import Model
+
+
+class Customer(Model):
     """ Class initializer. It has 1 custom parameter, with the
      special `self` parameter that every method on a class
      needs as the first parameter. """
 
+    __slots__ = ('id', 'name', 'address', 'email', 'password')
+
     def __init__(self, id, name, address, email = "", password = ""):
         self.id = id
         self.name = name
@@ -1,8 +1,13 @@
-class Employee():
+from .model import Model
+
+
+class Employee(Model):
     """ Class initializer. It has 1 custom parameter, with the
      special `self` parameter that every method on a class
      needs as the first parameter. """
 
+    __slots__ = ('id', 'name', 'address', 'location_id', 'location')
+
     def __init__(self, id, name, address, location_id):
         self.id = id
         self.name = name
@@ -1,8 +1,13 @@
-class Location():
+from .model import Model
+
+
+class Location(Model):
     """ Class initializer. It has 2 custom parameters, with the
      special `self` parameter that every method on a class
      needs as the first parameter. """
 
+    __slots__ = ('id', 'name', 'address')
+
     def __init__(self, id, name, address):
         self.id = id
         self.name = name
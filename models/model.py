@@ -0,0 +1,14 @@
+class Model():
+    """ Base for the models. Subclasses list their attributes in
+    `__slots__`, which stores them in a fixed array on the instance
+    instead of a per-instance `__dict__`, and keeps them in that order
+    when turned into a dictionary. """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """ The model as a dictionary, ready to be encoded as JSON """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
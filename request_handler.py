@@ -1,22 +1,85 @@
+import argparse
 import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, urlencode
 
-from views import get_all_animals, get_all_locations, get_all_employees, get_all_customers
+from views import ROUTES, get_stats
 
-from views import get_single_animal, get_single_location, get_single_employee, get_single_customer
+import database
 
-from views import create_animal, create_location, create_employee, create_customer
+from database import MAX_PAGE_SIZE, versions
 
-from views import delete_animal, delete_location, delete_employee, delete_customer
+from database.repository import DEFAULT_SEARCH_LIMIT
 
-from views import update_animal, update_location, update_employee, update_customer
+from database.migrations import migrate
 
-from views import get_customer_by_email,  get_employee_by_location
+import change_feed
+
+import compression
+
+import telemetry
+
+from servers import AsyncHTTPServer, PooledHTTPServer
+
+from servers import adopt_socket, serve_prefork
+
+# Roughly how many bytes of JSON are sent in each chunk of a streamed list
+STREAM_CHUNK_SIZE = 16384
+
+# What Prometheus expects /metrics to be served as
+METRICS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Each line of an /export is one JSON object
+NDJSON_TYPE = 'application/x-ndjson'
+
+# What /changes is served as
+EVENT_STREAM_TYPE = 'text/event-stream'
+
+# The most values one filter may be given, e.g. ?status=a&status=b
+MAX_FILTER_VALUES = 50
+
+# Seconds between looks for changes other processes made to the file
+CHANGE_WATCH_INTERVAL = 1
+
+# Seconds a client is asked to wait before retrying a write that timed
+# out or found the database locked
+WRITE_RETRY_AFTER = 1
+
+# Errors from a write that mean the body was bad rather than the server,
+# such as a null or an object where SQLite wanted a value
+BAD_WRITE_ERRORS = (ValueError, sqlite3.IntegrityError,
+                    sqlite3.ProgrammingError)
+
+
+class Endpoint():
+    """ A GET url answered by the request handler itself, rather than by
+    a resource's views in ROUTES
+
+    Args:
+        answer (function): the HandleRequests method that answers it
+        per_resource (bool): the url names a resource next, as in
+            /export/animals, and is counted in the metrics per resource
+    """
+
+    def __init__(self, answer, per_resource=False):
+        self.answer = answer
+        self.per_resource = per_resource
+
+    def label(self, name, path_params):
+        """The url pattern requests to it are counted under"""
+        if not self.per_resource:
+            return f'/{name}'
+        if len(path_params) == 3 and path_params[2] in ROUTES:
+            return f'/{name}/{path_params[2]}'
+        return 'other'
 
-from views import get_animal_by_location, get_animal_by_status
 
 # Here's a class. It inherits from another class.
 # For now, think of a class as a container for functions that
@@ -28,6 +91,107 @@ class HandleRequests(BaseHTTPRequestHandler):
     """Controls the functionality of any GET, PUT, POST, DELETE requests to the server
     """
 
+    # Speak HTTP/1.1 so clients can keep one connection open for many
+    # requests. Every response must then say how long its body is.
+    protocol_version = "HTTP/1.1"
+
+    # Seconds to wait for the rest of a request once it has started to
+    # arrive. The pooled server waits for idle kept-alive connections
+    # without a worker, so this only bounds a slow client, and the
+    # single-threaded server's idle connections.
+    timeout = 15
+
+    # Buffer each response, which is flushed once the request is handled,
+    # so its headers and body leave in one write rather than the body
+    # waiting on the client's delayed ACK of the headers
+    wbufsize = STREAM_CHUNK_SIZE
+
+    # A body larger than the buffer is still written after its headers,
+    # so Nagle's algorithm must not hold it back either
+    disable_nagle_algorithm = True
+
+    def parse_request(self):
+        """Starts timing a request once its request line has been read"""
+        self._started = time.perf_counter()
+        self._received = time.time()
+        self._body = None
+        self._status = None
+        self._sent = 0
+        self._view = None
+        # Left as None if the request line or headers can't be parsed,
+        # rather than holding the previous request's
+        self.path = None
+        self.headers = None
+        telemetry.start_request()
+        self._profile = telemetry.PROFILER.start()
+        return super().parse_request()
+
+    def handle_one_request(self):
+        """Handles one request and records its metrics"""
+        self._started = None
+        self._profile = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._profile is not None:
+                telemetry.PROFILER.finish(self._profile, self._route_label())
+
+        # Nothing is recorded for a connection closed while idle
+        if self._started is None or self._status is None:
+            return
+
+        seconds = time.perf_counter() - self._started
+        telemetry.METRICS.record(
+            self._route_label(), self.command, self._status, seconds,
+            self._sent, self._view, telemetry.sql_time())
+
+        # A request that couldn't be parsed can't be replayed
+        if telemetry.CAPTURE.enabled and self.headers is not None:
+            telemetry.CAPTURE.record({
+                "ts": round(self._received, 6),
+                "method": self.command,
+                "path": self.path,
+                "headers": dict(self.headers.items()),
+                "body": self._body.decode(errors="replace")
+                if self._body else None,
+                "status": self._status,
+                "duration_ms": round(seconds * 1000, 3),
+            })
+
+    def send_response(self, code, message=None):
+        """Remembers the status code for the metrics as it is sent"""
+        self._status = code
+        super().send_response(code, message)
+
+    def _route_label(self):
+        """The url pattern a request is counted under, e.g.
+        /animals/{id}, so the metrics have one series per route rather
+        than one per url"""
+        # A request line too bad to parse never sets the path
+        path = getattr(self, 'path', None)
+        if path is None:
+            return 'other'
+        path_params = urlparse(path).path.split('/')
+        resource = path_params[1] if len(path_params) > 1 else ''
+        endpoint = ENDPOINTS.get(resource)
+        if endpoint is not None:
+            return endpoint.label(resource, path_params)
+        if resource not in ROUTES:
+            return 'other'
+        if len(path_params) > 2 and path_params[2]:
+            return f'/{resource}/{{id}}'
+        return f'/{resource}'
+
+    def _call(self, view, *args):
+        """Calls a view function, remembering its name for the metrics"""
+        self._view = view.__name__
+        return view(*args)
+
+    def _write(self, data):
+        """Writes part of the response body, counting it for the metrics"""
+        self._sent += len(data)
+        self.wfile.write(data)
+
     def parse_url(self, path):
         """Parse the url into the resource and id"""
         parsed_url = urlparse(path)
@@ -45,133 +209,696 @@ class HandleRequests(BaseHTTPRequestHandler):
             pass
         return (resource, pk)
 
-    def do_GET(self):
-        """ Handles the GET """
-        self._set_headers(200)
+    def parse_path(self):
+        """The resource and id in the url's path, leaving out any query
 
-        response = {}
+        Returns:
+            tuple: (resource, id), where id is None if the path has none
+
+        Raises:
+            ValueError: if the id is not a whole number
+        """
+        path_params = urlparse(self.path).path.split('/')
+        resource = path_params[1] if len(path_params) > 1 else ''
+        if len(path_params) < 3 or not path_params[2]:
+            return (resource, None)
+        try:
+            return (resource, int(path_params[2]))
+        except ValueError as ex:
+            raise ValueError("the id must be a whole number") from ex
 
+    def do_GET(self):
+        """ Handles the GET """
         # Parse URL and store entire tuple in a variable
         parsed = self.parse_url(self.path)
 
-        # If the path does not include a query parameter, continue with the original if block
-        if '?' not in self.path:
-            (resource, id) = parsed
-
-            if resource == "animals":
-                if id is not None:
-                    response = get_single_animal(id)
-                else:
-                    response = get_all_animals()
-            elif resource == "customers":
-                if id is not None:
-                    response = get_single_customer(id)
-                else:
-                    response = get_all_customers()
-            elif resource == "employees":
-                if id is not None:
-                    response = get_single_employee(id)
-                else:
-                    response = get_all_employees()
-            elif resource == "locations":
-                if id is not None:
-                    response = get_single_location(id)
-                else:
-                    response = get_all_locations()
-
-        else:  # There is a ? in the path, run the query param functions
-            (resource, query) = parsed
-
-            # see if the query dictionary has an email key
-            if query.get('email') and resource == 'customers':
-                response = get_customer_by_email(query['email'][0])
-            elif query.get('location_id') and resource == 'animals':
-                response = get_animal_by_location(query['location_id'][0])
-            elif query.get('location_id') and resource == 'employees':
-                response = get_employee_by_location(query['location_id'][0])
-            elif query.get('status') and resource == 'animals':
-                response = get_animal_by_status(query['status'][0])
-
-        self.wfile.write(json.dumps(response).encode())
+        # /metrics, /stats and the like are answered here
+        endpoint = ENDPOINTS.get(parsed[0])
+        if endpoint is not None:
+            endpoint.answer(self)
+            return
+
+        route = ROUTES.get(parsed[0])
+        if route is None:
+            self._send_json(404, {})
+            return
+
+        # If the client already has the current version, say so without
+        # touching the database or encoding any JSON
+        etag = self.etag_for(parsed)
+        if etag is not None and self._client_has(etag):
+            self._set_headers(304, None, {'ETag': etag})
+            return
+
+        cache_headers = {}
+        if etag is not None:
+            cache_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+            # The same version may already have been compressed for
+            # another client, in which case it is sent straight away
+            encoding = self._accepted_encoding()
+            cached = compression.RESPONSE_CACHE.get(
+                (self.path, etag, encoding)) if encoding else None
+            if cached is not None:
+                (body, headers) = cached
+                self._set_headers(200, len(body), headers)
+                self._write(body)
+                return
+
+        # /animals/1?_expand=location still names one animal
+        url = urlparse(self.path)
+        (resource, id) = self.parse_url(url.path)
+        query = parse_qs(url.query)
+
+        # ?limit=&after= ask for one page of a list, starting after
+        # the id the client saw last
+        try:
+            (limit, after) = self.parse_page(query)
+        except ValueError:
+            self._send_json(400, {
+                "message": "limit and after must be whole numbers, "
+                           "and limit must be at least 1"})
+            return
+
+        # Whole lists are streamed as JSON text made straight from
+        # the rows; a page is collected as dictionaries instead
+        encoded = limit is None
+
+        try:
+            # ?_expand=location,customer attaches those relations
+            expand = self.parse_expand(query)
+
+            # ?q=bea searches the resource, best match first
+            if query.get('q') and id is None:
+                self._search(resource, route, query, limit, after, expand,
+                             cache_headers)
+                return
+
+            # ?id=1,5,9 fetches several entities in one request
+            if query.get('id'):
+                self._get_by_id(resource, route, query, expand,
+                                cache_headers)
+                return
+
+            if id is not None:
+                response = self._call(route.get_single, id, expand)
+            else:
+                filters = self.parse_filters(resource, route, query)
+                response = self._call(route.iter_all, limit, after, encoded,
+                                      expand, filters)
+        except ValueError as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+
+        # A page is small, so collect it to find the next cursor
+        if id is None and limit is not None:
+            response = list(response)
+
+            # A full page means there may be more, so tell the client
+            # where the next one starts
+            if len(response) == limit:
+                next_cursor = response[-1]['id']
+                next_query = urlencode(
+                    {**query, 'after': [next_cursor]}, doseq=True)
+                self._send_json(200, response, {
+                    **cache_headers,
+                    'X-Next-Cursor': str(next_cursor),
+                    'Link': f'</{resource}?{next_query}>; rel="next"'
+                })
+                return
+
+        if response is None:
+            self._send_json(404, {})
+        elif isinstance(response, (dict, list)):
+            self._send_json(200, response, cache_headers)
+        else:
+            self._stream_json(200, response, cache_headers)
+
+    def _metrics(self):
+        """Sends the request metrics in the Prometheus text format"""
+        body = telemetry.METRICS.render().encode()
+        self._set_headers(200, len(body), {'Content-type': METRICS_TYPE})
+        self._write(body)
+
+    def _stats(self):
+        """Sends the animal and employee counts per location, answering
+        If-None-Match from the version counters like any list"""
+        etag = versions.collection_etag('stats')
+        if self._client_has(etag):
+            self._set_headers(304, None, {'ETag': etag})
+            return
+        self._send_json(200, self._call(get_stats), {
+            'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    def _changes(self):
+        """Streams every create, update and delete as Server-Sent Events,
+        e.g. GET /changes?resource=animals&resource=customers
+
+        A client that reconnects with Last-Event-ID, or ?after=, is sent
+        the changes it missed first. The connection is handed to the
+        change feed, so the request thread is free again at once.
+        """
+        detach = getattr(self.server, 'detach', None)
+        if detach is None:
+            self._send_json(501, {
+                "message": "/changes needs the threaded server: --threads 2 "
+                           "or more, without --asyncio"})
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        resources = None
+        if 'resource' in query:
+            resources = {name for value in query['resource']
+                         for name in value.split(',') if name}
+            unknown = sorted(resources - set(ROUTES))
+            if unknown:
+                self._send_json(400, {
+                    "message": f"unknown resource: {', '.join(unknown)}"})
+                return
+
+        after = self.headers.get('Last-Event-ID') \
+            or query.get('after', [None])[-1]
+        if after is not None:
+            try:
+                after = int(after)
+            except ValueError:
+                self._send_json(400, {
+                    "message": "Last-Event-ID must be an integer"})
+                return
+
+        self.close_connection = True
+        self._set_headers(200, None, {
+            'Content-type': EVENT_STREAM_TYPE, 'Cache-Control': 'no-cache',
+            'Connection': 'close'})
+        self._write(b'retry: 2000\n\n')
+        self.wfile.flush()
+        detach(self.connection)
+        change_feed.FEED.subscribe(self.connection, after, resources)
+
+    def _export(self):
+        """Streams every row of a resource as newline delimited JSON, e.g.
+        GET /export/animals?status=Kennel&_expand=location
+
+        Unlike a list, an export is never paged, so it suits copying a
+        whole table out; database.importer reads the same format back in.
+        """
+        url = urlparse(self.path)
+        path_params = url.path.split('/')
+        resource = path_params[2] if len(path_params) == 3 else None
+        route = ROUTES.get(resource)
+        if route is None:
+            self._send_json(404, {})
+            return
+
+        etag = versions.collection_etag(resource)
+        if etag is not None and self._client_has(etag):
+            self._set_headers(304, None, {'ETag': etag})
+            return
+        cache_headers = {}
+        if etag is not None:
+            cache_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        query = parse_qs(url.query)
+        try:
+            expand = self.parse_expand(query)
+            filters = self.parse_filters(resource, route, query)
+            rows = self._call(route.iter_all, None, None, False, expand,
+                              filters)
+        except ValueError as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+
+        self._stream_json(200, rows, cache_headers, ndjson=True)
+
+    def _search(self, resource, route, query, limit, after, expand,
+                cache_headers):
+        """Sends the entities matching ?q=, best first, a page at a time
+        with ?limit= and ?offset=
+
+        Args:
+            resource (str): e.g. "animals"
+            route (Route): the views for the resource
+            query (dict): the parsed query string
+            limit (int): the page size asked for, or None
+            after (int): must be None; search pages by offset
+            expand (tuple): relations to attach to each entity
+            cache_headers (dict): the ETag headers for the resource
+
+        Raises:
+            ValueError: for a resource that can't be searched, or a bad
+                offset or filter
+        """
+        if route.search is None:
+            raise ValueError(f"{resource} can't be searched")
+        if after is not None:
+            raise ValueError("search results are paged with offset, "
+                             "not after")
+        try:
+            offset = int(query.get('offset', ['0'])[0])
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise ValueError("offset must be a whole number")
+
+        filters = self.parse_filters(resource, route, query)
+        response = self._call(route.search, query['q'][0], limit, offset,
+                              expand, filters)
+
+        headers = dict(cache_headers)
+        # A full page means there may be more matches after it
+        if response and len(response) == min(
+                limit or DEFAULT_SEARCH_LIMIT,
+                MAX_PAGE_SIZE):
+            next_query = urlencode(
+                {**query, 'offset': [offset + len(response)]}, doseq=True)
+            headers['Link'] = f'</{resource}?{next_query}>; rel="next"'
+        self._send_json(200, response, headers)
+
+    def _get_by_id(self, resource, route, query, expand, cache_headers):
+        """Sends the entities named in an ?id= list, in the order they were
+        asked for, with the ids that don't exist in X-Missing-Ids
+
+        Args:
+            resource (str): e.g. "animals"
+            route (Route): the views for the resource
+            query (dict): the parsed query string
+            expand (tuple): relations to attach to each entity
+            cache_headers (dict): the ETag headers for the resource
+
+        Raises:
+            ValueError: for any parameter besides id and _expand
+        """
+        # Unknown parameters answer 400 as they do on a list; known ones
+        # would narrow the ids asked for, which is better done by asking
+        # for fewer
+        if self.parse_filters(resource, route, query) or any(
+                name in query for name in ('limit', 'after', 'offset')):
+            raise ValueError("id can't be combined with filters or paging")
+
+        try:
+            ids = [int(id) for value in query['id']
+                   for id in value.split(',') if id.strip()]
+        except ValueError:
+            self._send_json(400, {"message": "id must be a comma separated "
+                                             "list of whole numbers"})
+            return
+
+        if len(ids) > MAX_PAGE_SIZE:
+            self._send_json(400, {
+                "message": f"ask for at most {MAX_PAGE_SIZE} ids at once"})
+            return
+
+        (response, missing) = self._call(route.get_by_id, ids, expand)
+
+        headers = dict(cache_headers)
+        if missing:
+            headers['X-Missing-Ids'] = ",".join(str(id) for id in missing)
+        self._send_json(200, response, headers)
+
+    def etag_for(self, parsed):
+        """Finds the ETag for a parsed GET url from the version counters
+
+        Args:
+            parsed (tuple): what parse_url returned for the url
+
+        Returns:
+            str: the ETag, or None for urls that are not versioned
+        """
+        (resource, id_or_query) = parsed
+
+        if isinstance(id_or_query, int):
+            return versions.entity_etag(resource, id_or_query)
+        return versions.collection_etag(resource)
+
+    def _client_has(self, etag):
+        """Checks whether the If-None-Match header matches the ETag"""
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate in ('*', etag):
+                return True
+        return False
+
+    def parse_expand(self, query):
+        """Reads the relations named in ?_expand=, e.g. location,customer
+
+        Args:
+            query (dict): the parsed query string
+
+        Returns:
+            tuple: the relation names, without repeats, in the order given
+        """
+        names = [name.strip() for value in query.get('_expand', [])
+                 for name in value.split(',') if name.strip()]
+        return tuple(dict.fromkeys(names))
+
+    def parse_filters(self, resource, route, query):
+        """Reads the filters in a query string, e.g.
+        ?location_id=2&status=Kennel. A filter given more than once, as in
+        ?status=Kennel&status=Treatment, matches any of its values.
+
+        Args:
+            resource (str): e.g. "animals"
+            route (Route): the views for the resource
+            query (dict): the parsed query string
+
+        Returns:
+            dict: column -> the list of values it may have
+
+        Raises:
+            ValueError: for a parameter the resource can't be filtered by
+        """
+        filters = {}
+        for (name, values) in query.items():
+            # limit, after, id, q and offset are handled on their own,
+            # and other parameters starting with _ are for the client,
+            # such as cache busters
+            if name in ('limit', 'after', 'id', 'q', 'offset') \
+                    or name.startswith('_'):
+                continue
+            if name not in route.filters:
+                raise ValueError(f"{resource} can't be filtered by {name}")
+            if len(values) > MAX_FILTER_VALUES:
+                raise ValueError(f"{name} can have at most "
+                                 f"{MAX_FILTER_VALUES} values")
+            filters[name] = values
+        return filters
+
+    def parse_page(self, query):
+        """Reads the limit and after pagination parameters from a query
+
+        Args:
+            query (dict): the parsed query string
+
+        Returns:
+            tuple: (limit, after), either of which may be None
+        """
+        limit = None
+        after = None
+
+        if query.get('limit'):
+            limit = min(int(query['limit'][0]), MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+        if query.get('after'):
+            after = int(query['after'][0])
+
+        return (limit, after)
 
     # Here's a method on the class that overrides the parent's method.
     def do_POST(self):
         """Handles the POST"""
-        self._set_headers(201)
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-
-        # Convert JSON string to a Python dictionary
-        post_body = json.loads(post_body)
+        post_body = self._read_body()
 
         # Parse the URL
         (resource, id) = self.parse_url(self.path)
 
-        # Initialize new animal
-        new_animal = None
-
-        # Add a new animal to the list. Don't worry about
-        # the orange squiggle, you'll define the create_animal
-        # function next.
-        if resource == "animals":
-            new_animal = create_animal(post_body)
-            # Encode the new animal and send in response
-            self.wfile.write(json.dumps(new_animal).encode())
+        route = ROUTES.get(resource)
+        if route is None:
+            self._send_json(404, {})
+            return
 
-        elif resource == "locations":
-            new_location = create_location(post_body)
-            self.wfile.write(json.dumps(new_location).encode())
-
-        elif resource == "employees":
-            new_employee = create_employee(post_body)
-            self.wfile.write(json.dumps(new_employee).encode())
+        try:
+            # Convert JSON string to a Python dictionary
+            post_body = self.parse_json(post_body)
 
-        elif resource == "customers":
-            new_customer = create_customer(post_body)
-            self.wfile.write(json.dumps(new_customer).encode())
+            # A list of entities is created in one transaction
+            if isinstance(post_body, list):
+                created = self._call(route.create_many, post_body)
+            else:
+                created = self._call(route.create, post_body)
+        except BAD_WRITE_ERRORS as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+        except sqlite3.OperationalError as ex:
+            self._write_unavailable(ex)
+            return
+        self._send_json(201, created)
 
     # A method that handles any PUT request.
 
     def do_PUT(self):
         """ Handles the PUT """
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-        post_body = json.loads(post_body)
+        post_body = self._read_body()
 
         # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+        try:
+            (resource, id) = self.parse_path()
+        except ValueError as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+
+        route = ROUTES.get(resource)
+        if route is None:
+            self._send_json(404, {})
+            return
 
-        success = False
+        try:
+            post_body = self.parse_json(post_body)
 
-        if resource == "animals":
-            success = update_animal(id, post_body)
-        elif resource == "locations":
-            success = update_location(id, post_body)
-        elif resource == "employees":
-            success = update_employee(id, post_body)
-        elif resource == "customers":
-            success = update_customer(id, post_body)
+            # A list of entities, each with its id, sent to the resource
+            # itself is updated in one transaction
+            if id is None and not isinstance(post_body, list):
+                raise ValueError(f"PUT one of the {resource} to "
+                                 f"/{resource}/<id>, or a list of them "
+                                 f"to /{resource}")
+            if isinstance(post_body, list) and id is None:
+                missing = self._call(route.update_many, post_body)
+                if missing:
+                    self._send_json(404, {"missing": missing})
+                    return
+                success = True
+            else:
+                success = self._call(route.update, id, post_body)
+        except BAD_WRITE_ERRORS as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+        except sqlite3.OperationalError as ex:
+            self._write_unavailable(ex)
+            return
 
         if success:
             self._set_headers(204)
         else:
-            self._set_headers(404)
-
-        self.wfile.write("".encode())
+            self._send_json(404, {})
 
-    def _set_headers(self, status):
+    def _set_headers(self, status, content_length=0, headers=None):
         # Notice this Docstring also includes information about the arguments passed to the function
-        """Sets the status code, Content-Type and Access-Control-Allow-Origin
-        headers on the response
+        """Sets the status code, Content-Type, Content-Length and
+        Access-Control-Allow-Origin headers on the response
 
         Args:
             status (204): the status code to return to the front end
+            content_length (int): the size in bytes of the body that follows,
+                or None when the body is sent in chunks
+            headers (dict): any extra headers to send, including a
+                Content-type other than JSON
         """
+        headers = dict(headers or {})
         self.send_response(status)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type',
+                         headers.pop('Content-type', 'application/json'))
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers',
+                         'X-Next-Cursor, X-Missing-Ids, Link, ETag')
+        # The body may be compressed or not depending on Accept-Encoding
+        self.send_header('Vary', 'Accept-Encoding')
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        # A 204 or 304 never has a body, so it must not carry a Content-Length
+        if status not in (204, 304) and content_length is not None:
+            self.send_header('Content-Length', str(content_length))
         self.end_headers()
 
+    def _send_json(self, status, payload, headers=None):
+        """Encodes the payload as JSON and sends it with its headers
+
+        Args:
+            status (200): the status code to return to the front end
+            payload (dict or list): the data to send in the body
+            headers (dict): any extra headers to send
+        """
+        self._send_body(status, json.dumps(payload).encode(), headers)
+
+    def _send_body(self, status, body, headers=None):
+        """Sends an encoded JSON body, compressed if the client accepts it
+        and it is large enough to be worth it.
+
+        A compressed 200 response to a GET that has an ETag is kept in the
+        response cache for the next client asking for the same version.
+
+        Args:
+            status (200): the status code to return to the front end
+            body (bytes): the JSON to send
+            headers (dict): any extra headers to send
+        """
+        headers = dict(headers or {})
+        encoding = self._accepted_encoding()
+
+        if encoding is not None and len(body) >= compression.MIN_SIZE:
+            body = compression.compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+            etag = self._weaken_etag(headers)
+
+            if status == 200 and self.command == 'GET' and etag is not None:
+                compression.RESPONSE_CACHE.put(
+                    (self.path, etag, encoding), body, headers)
+
+        self._set_headers(status, len(body), headers)
+        self._write(body)
+
+    def _accepted_encoding(self):
+        """The compression to use for this response, or None"""
+        return compression.negotiate(self.headers.get('Accept-Encoding'))
+
+    def _weaken_etag(self, headers):
+        """Marks the ETag in a compressed response's headers as weak, since
+        the bytes differ from the uncompressed ones with the same tag
+
+        Returns:
+            str: the ETag as it was, or None if there isn't one
+        """
+        etag = headers.get('ETag')
+        if etag is not None:
+            headers['ETag'] = 'W/' + etag
+        return etag
+
+    def _stream_json(self, status, rows, headers=None, ndjson=False):
+        """Sends an iterable of rows as one JSON array, encoding and writing
+        them as they are produced instead of building the whole list first.
+
+        HTTP/1.1 clients get the body with chunked transfer encoding, so
+        the first rows go out while later ones are still being read from
+        the database. HTTP/1.0 clients cannot read chunks and get the
+        collected list instead, as does any list small enough to fit in
+        the first chunk.
+
+        A compressed stream is compressed chunk by chunk, and kept in the
+        response cache once it is complete, like _send_body does.
+
+        Args:
+            status (200): the status code to return to the front end
+            rows (iterable): the dictionaries to send as a JSON array, or
+                pieces of already encoded JSON text for one or more of them
+            headers (dict): any extra headers to send
+            ndjson (bool): send each row on its own line instead of in an
+                array; rows must then be dictionaries
+        """
+        headers = dict(headers or {})
+        chunked = self.request_version != 'HTTP/1.0'
+        encoding = self._accepted_encoding()
+        stream = None
+        etag = None
+        started = False
+        cached = [] if encoding is not None else None
+        cached_size = 0
+
+        encode = json.JSONEncoder().encode
+        if ndjson:
+            headers['Content-type'] = NDJSON_TYPE
+            (separator, between, empty, end) = ('', '\n', '', '\n')
+        else:
+            (separator, between, empty, end) = ('[', ', ', '[]', ']')
+        first = separator
+        buffer = []
+        size = 0
+
+        def send(data):
+            """Writes one chunk, compressed if the client accepts it"""
+            nonlocal cached, cached_size
+
+            if stream is not None:
+                data = stream.compress(data) + stream.flush(zlib.Z_SYNC_FLUSH)
+            self._write_chunk(data)
+
+            if cached is not None:
+                cached.append(data)
+                cached_size += len(data)
+                if cached_size > compression.RESPONSE_CACHE.max_entry_bytes:
+                    cached = None
+
+        try:
+            for row in rows:
+                if not isinstance(row, str):
+                    row = encode(row)
+                item = separator + row
+                separator = between
+                buffer.append(item)
+                size += len(item)
+
+                # Send rows in chunks of a useful size rather than one
+                # tiny chunk per row
+                if chunked and size >= STREAM_CHUNK_SIZE:
+                    if not started:
+                        if encoding is not None:
+                            stream = compression.compressor(encoding)
+                            headers['Content-Encoding'] = encoding
+                            etag = self._weaken_etag(headers)
+                        self._set_headers(
+                            status, None,
+                            {**headers, 'Transfer-Encoding': 'chunked'})
+                        started = True
+                    send(''.join(buffer).encode())
+                    buffer = []
+                    size = 0
+        finally:
+            # Stops the query and gives its connection back to the pool
+            # even if the client went away half way through
+            if hasattr(rows, 'close'):
+                rows.close()
+
+        # An empty list never sent its opening bracket
+        buffer.append(empty if separator == first else end)
+
+        # The whole list fit in one chunk, or the client can't read
+        # chunks, so send it with its length
+        if not started:
+            self._send_body(status, ''.join(buffer).encode(), headers)
+            return
+
+        send(''.join(buffer).encode())
+        if stream is not None:
+            tail = stream.flush()
+            self._write_chunk(tail)
+            if cached is not None and etag is not None:
+                cached.append(tail)
+                compression.RESPONSE_CACHE.put(
+                    (self.path, etag, encoding), b''.join(cached), headers)
+        self._write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data):
+        """Writes one chunk of a chunked response body"""
+        self._write(f'{len(data):X}\r\n'.encode() + data + b'\r\n')
+
+    def _read_body(self):
+        """Reads exactly the request body the client said it was sending,
+        leaving the connection ready for the next request"""
+        content_len = int(self.headers.get('content-length', 0))
+        self._body = self.rfile.read(content_len)
+        return self._body
+
+    def _write_unavailable(self, ex):
+        """Answers a write that timed out waiting for the writer, or found
+        the database busy or locked, with 503 and when to try again"""
+        self._send_json(503, {"message": f"the write was not made: {ex}"},
+                        {'Retry-After': str(WRITE_RETRY_AFTER)})
+
+    def parse_json(self, body):
+        """Decodes a request body
+
+        Raises:
+            ValueError: if the body is not valid JSON
+        """
+        try:
+            return json.loads(body)
+        except ValueError as ex:
+            raise ValueError(f"the body is not JSON: {ex}") from ex
+
     # Another method! This supports requests with the OPTIONS verb.
 
     def do_OPTIONS(self):
@@ -182,40 +909,198 @@ class HandleRequests(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Methods',
                          'GET, POST, PUT, DELETE')
         self.send_header('Access-Control-Allow-Headers',
-                         'X-Requested-With, Content-Type, Accept')
+                         'X-Requested-With, Content-Type, Accept, '
+                         'If-None-Match')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def do_DELETE(self):
         """ Handles DELETE requests """
-        # Set a 204 response code
-        self._set_headers(204)
+        # Discard any body so the next request on this connection
+        # starts where it should
+        self._read_body()
 
         # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+        try:
+            (resource, id) = self.parse_path()
+        except ValueError as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
 
-        # Delete a single animal from the list
-        if resource == "animals":
-            delete_animal(id)
+        route = ROUTES.get(resource)
+        if route is None:
+            self._send_json(404, {})
+            return
+        if id is None:
+            self._send_json(400, {
+                "message": f"DELETE one of the {resource} at /{resource}/<id>"})
+            return
 
-        elif resource == "locations":
-            delete_location(id)
+        try:
+            deleted = self._call(route.delete, id)
+        except BAD_WRITE_ERRORS as ex:
+            self._send_json(400, {"message": str(ex)})
+            return
+        except sqlite3.OperationalError as ex:
+            self._write_unavailable(ex)
+            return
+
+        # Set a 204 response code, or 404 if there was nothing to delete
+        if deleted:
+            self._set_headers(204)
+        else:
+            self._send_json(404, {})
+
+
+ENDPOINTS = {
+    'metrics': Endpoint(HandleRequests._metrics),
+    'stats': Endpoint(HandleRequests._stats),
+    'changes': Endpoint(HandleRequests._changes),
+    'export': Endpoint(HandleRequests._export, per_resource=True),
+}
 
-        elif resource == "employees":
-            delete_employee(id)
 
-        elif resource == "customers":
-            delete_customer(id)
-            # Encode the new customer and send in response
+def start_replica_checks(replica, seconds):
+    """Compares the replica with the database file every few seconds on a
+    background thread"""
+    def check_forever():
+        while True:
+            time.sleep(seconds)
+            replica.check()
+
+    threading.Thread(target=check_forever, name="replica-check",
+                     daemon=True).start()
+
+
+def start_change_watch(seconds):
+    """Gives new ETags to whatever other processes, such as
+    database.importer, change in the database file, looking at its
+    changes table every few seconds on a background thread.
+
+    It can't tell them from this server's own writes, whose entities get
+    a second new ETag; that costs a client that fetched one in between
+    an extra response, rather than a stale one.
+    """
+    def watch_forever():
+        after = database.changes.last_change_id()
+        while True:
+            time.sleep(seconds)
+            try:
+                after = database.changes.bump_versions(after)
+            except sqlite3.OperationalError:
+                # Busy or locked; the next look will find them
+                pass
+
+    threading.Thread(target=watch_forever, name="change-watch",
+                     daemon=True).start()
 
 
 # This function is not inside the class. It is the starting
 # point of this application.
-def main():
+def main(argv=None):
     """Starts the server on port 8088 using the HandleRequests class
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
     """
-    host = ''
-    port = 8088
-    HTTPServer((host, port), HandleRequests).serve_forever()
+    parser = argparse.ArgumentParser(description="Kennels API server")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--database", default=database.DATABASE_PATH,
+                        help="path to the SQLite database file")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="worker threads serving requests concurrently "
+                             "from a shared connection pool; 1 runs the "
+                             "plain single-threaded HTTPServer")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="hold connections on an asyncio event loop and "
+                             "run requests on --threads worker threads")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="pre-fork this many worker processes sharing "
+                             "the port; 0 starts one per CPU core")
+    parser.add_argument("--profile-rate", type=float, default=0,
+                        help="cProfile this share of requests, e.g. 0.01, "
+                             "adding each to a pstats file for its route")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="where --profile-rate writes its pstats files")
+    parser.add_argument("--slow-query-ms", type=float, default=None,
+                        help="log every SQL statement slower than this, "
+                             "with its parameters")
+    parser.add_argument("--slow-query-log", default=None,
+                        help="file for --slow-query-ms; stderr by default")
+    parser.add_argument("--replica", action="store_true",
+                        help="load the database into memory at startup and "
+                             "serve reads from there; writes still go to "
+                             "the file first")
+    parser.add_argument("--replica-check", type=float, default=None,
+                        metavar="SECONDS",
+                        help="compare the in-memory replica with the file "
+                             "this often, copying it again if they differ")
+    parser.add_argument("--capture", default=None, metavar="FILE",
+                        help="append every request to this JSONL file, "
+                             "for python -m benchmarks.replay")
+    args = parser.parse_args(argv)
+
+    processes = args.processes or os.cpu_count()
+    if args.replica and processes > 1:
+        parser.error("--replica only sees writes made by its own process, "
+                     "so it can't be used with --processes")
+
+    telemetry.configure_profiling(args.profile_rate, args.profile_dir)
+    telemetry.configure_capture(args.capture)
+    if args.slow_query_ms is not None:
+        telemetry.configure_slow_queries(args.slow_query_ms / 1000,
+                                         args.slow_query_log)
+
+    # Bring the schema up to date before any worker starts
+    migrate(args.database)
+
+    # One pooled connection per worker thread
+    database.configure(database=args.database, size=args.threads,
+                       replica=args.replica)
+    if args.replica:
+        # Copy the file into memory now rather than on the first request
+        replica = database.get_replica()
+        if args.replica_check:
+            start_replica_checks(replica, args.replica_check)
+
+    address = (args.host, args.port)
+
+    def make_server(sock=None):
+        """ Builds the server for the chosen mode, optionally on a socket
+        that is already listening """
+        # A thread doesn't survive a fork, so each worker starts its own.
+        # The replica doesn't see the file's changes until --replica-check
+        # copies them, which gives them new ETags itself.
+        if not args.replica:
+            start_change_watch(CHANGE_WATCH_INTERVAL)
+
+        if args.asyncio:
+            return AsyncHTTPServer(address, HandleRequests,
+                                   workers=args.threads, sock=sock)
+
+        bind = sock is None
+        if args.threads > 1:
+            server = PooledHTTPServer(address, HandleRequests,
+                                      workers=args.threads,
+                                      bind_and_activate=bind)
+        else:
+            server = HTTPServer(address, HandleRequests,
+                                bind_and_activate=bind)
+        if sock is not None:
+            adopt_socket(server, sock)
+        return server
+
+    if processes > 1:
+        serve_prefork(address, make_server, processes)
+        return
+
+    server = make_server()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        telemetry.CAPTURE.flush()
 
 
 if __name__ == "__main__":
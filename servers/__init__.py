@@ -0,0 +1,5 @@
+from .threaded import PooledHTTPServer
+
+from .async_server import AsyncHTTPServer
+
+from .prefork import adopt_socket, serve_prefork
@@ -0,0 +1,128 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+# Largest request line + headers we will buffer for one request
+MAX_HEADER_BYTES = 65536
+
+
+class AsyncHTTPServer():
+    """ Holds open connections on an asyncio event loop and only hands a
+    request to a worker thread once it has fully arrived.
+
+    Idle keep-alive sockets and slow clients cost a coroutine instead of
+    a thread. The request itself is still answered by the regular
+    handler class (e.g. HandleRequests), so the same views and routes
+    are used as in every other server mode.
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        handler_class (class): a BaseHTTPRequestHandler subclass
+        workers (int): how many requests can run the views at once
+        idle_timeout (float): seconds an idle connection is kept open
+        sock (socket): an already listening socket to accept from instead
+            of binding server_address, as used by pre-fork workers
+    """
+
+    def __init__(self, server_address, handler_class, workers=8,
+                 idle_timeout=60, sock=None):
+        self.server_address = server_address
+        self.sock = sock
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="kennel-async-worker")
+        self.handler_class = _buffered(handler_class)
+
+    def _run_handler(self, raw_request, client_address):
+        """ Runs on a worker thread. Returns the raw response bytes and
+        whether the handler asked for the connection to be closed """
+        handler = self.handler_class(raw_request, client_address, self)
+        return handler.wfile.getvalue(), handler.close_connection
+
+    async def _handle_connection(self, reader, writer):
+        """ Reads requests off one connection until it closes """
+        loop = asyncio.get_running_loop()
+        client_address = writer.get_extra_info("peername")
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                    length = _content_length(head)
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+
+                response, close = await loop.run_in_executor(
+                    self.executor, self._run_handler, head + body,
+                    client_address)
+
+                writer.write(response)
+                await writer.drain()
+
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """ Accepts connections until cancelled """
+        if self.sock is not None:
+            server = await asyncio.start_server(
+                self._handle_connection, sock=self.sock,
+                limit=MAX_HEADER_BYTES)
+        else:
+            host, port = self.server_address
+            server = await asyncio.start_server(
+                self._handle_connection, host or None, port,
+                limit=MAX_HEADER_BYTES, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        """ Runs the event loop; blocks like HTTPServer.serve_forever """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def server_close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _content_length(head):
+    """ Finds the Content-Length in a raw request head, 0 if there is none """
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value.strip())
+            if length < 0:
+                raise ValueError("negative Content-Length")
+            return length
+    return 0
+
+
+def _buffered(handler_class):
+    """ Makes a version of handler_class that reads one request from bytes
+    and writes its response to memory instead of to a socket """
+
+    class BufferedHandler(handler_class):
+        """ Answers exactly one already-received request """
+
+        def setup(self):
+            self.rfile = io.BytesIO(self.request)
+            self.wfile = io.BytesIO()
+
+        def handle(self):
+            self.handle_one_request()
+
+        def finish(self):
+            pass
+
+    BufferedHandler.__name__ = handler_class.__name__
+    return BufferedHandler
@@ -0,0 +1,112 @@
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# A worker that dies sooner than this after starting is restarted only
+# after a short pause, so a crash on startup can't spin the CPU.
+MIN_WORKER_LIFETIME = 1.0
+
+
+def listen(server_address, backlog=1024):
+    """ Opens the listening socket that every worker process shares """
+    return socket.create_server(server_address, backlog=backlog)
+
+
+def adopt_socket(server, sock):
+    """ Points a socketserver-based server at an already listening socket.
+
+    The server must have been created with bind_and_activate=False.
+    """
+    server.socket.close()
+    server.socket = sock
+    server.server_address = sock.getsockname()
+    return server
+
+
+def serve_prefork(server_address, make_server, processes):
+    """ Forks `processes` workers that all accept from one listening socket
+    and restarts any worker that exits until the parent is told to stop.
+
+    Each worker runs its own server and its own connection pool, so JSON
+    encoding and model building are spread over every CPU core instead of
+    being held to one by the GIL.
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        make_server (function): called in each worker with the shared
+            socket; returns an object with serve_forever()
+        processes (int): how many worker processes to keep running
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("pre-fork mode needs os.fork(), which this "
+                           "platform does not have")
+
+    sock = listen(server_address)
+    workers = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(make_server, sock)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        spawn()
+
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            started = workers.pop(pid, None)
+            if started is None or stopping:
+                continue
+
+            print(f"worker {pid} exited with status {status}, restarting",
+                  file=sys.stderr)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not stopping:
+                spawn()
+    finally:
+        sock.close()
+
+
+def _run_worker(make_server, sock):
+    """ The body of a forked worker process. Never returns. """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    exit_code = 0
+    try:
+        server = make_server(sock)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stderr.flush()
+        os._exit(exit_code)
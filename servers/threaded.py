@@ -0,0 +1,185 @@
+import queue
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+
+class PooledHTTPServer(HTTPServer):
+    """ An HTTPServer that hands every accepted connection to a fixed
+    number of worker threads, so one slow request no longer blocks the
+    clients queued up behind it.
+
+    A worker handles one request at a time. When the client keeps the
+    connection open, the connection goes back to a selector thread that
+    waits for the next request to start arriving before queueing it for
+    a worker again, so idle keep-alive clients never hold a worker.
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        handler_class (class): the request handler, e.g. HandleRequests
+        workers (int): how many requests can be handled at the same time
+        idle_timeout (float): seconds an idle connection is kept open
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=8,
+                 bind_and_activate=True, idle_timeout=60):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="kennel-worker")
+        self._detached = set()
+        self._parking = queue.SimpleQueue()
+        (self._wake_reader, self._wake_writer) = socket.socketpair()
+        self._closing = False
+        self._idle_thread = threading.Thread(
+            target=self._wait_for_requests, name="kennel-idle", daemon=True)
+        self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        """ Queues the connection for the next free worker thread """
+        self.executor.submit(self.process_request_thread,
+                             request, client_address)
+
+    def process_request_thread(self, request, client_address, handler=None):
+        """ Runs on a worker thread: handles the next request on a
+        connection, then parks the connection if it is kept alive """
+        try:
+            if handler is None:
+                handler = self._start_handler(request, client_address)
+            # Mirrors BaseHTTPRequestHandler.handle, one request at a time
+            handler.close_connection = True
+            handler.handle_one_request()
+            if not handler.close_connection \
+                    and request not in self._detached:
+                if not self._has_buffered_request(handler):
+                    self._park(handler)
+                    return
+                self.executor.submit(self.process_request_thread,
+                                     request, client_address, handler)
+                return
+        except Exception:
+            self.handle_error(request, client_address)
+        self._finish(handler, request)
+
+    def _start_handler(self, request, client_address):
+        """ Builds a handler for a connection without handling anything
+        yet; BaseRequestHandler's constructor would handle every request
+        on it before returning """
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = request
+        handler.client_address = client_address
+        handler.server = self
+        handler.setup()
+        return handler
+
+    def _has_buffered_request(self, handler):
+        """ Whether the client has already sent part of its next request,
+        which may be sitting in the handler's read buffer where the
+        selector can't see it """
+        sock = handler.connection
+        try:
+            sock.setblocking(False)
+            return bool(handler.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.settimeout(handler.timeout)
+            except OSError:
+                pass
+
+    def _park(self, handler):
+        """ Hands an idle kept-alive connection to the selector thread """
+        self._parking.put(handler)
+        self._wake()
+
+    def _wake(self):
+        """ Interrupts the selector thread's wait """
+        try:
+            self._wake_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _finish(self, handler, request):
+        if handler is not None:
+            try:
+                handler.finish()
+            except OSError:
+                pass
+        self.shutdown_request(request)
+
+    def _wait_for_requests(self):
+        """ Runs on the selector thread: queues each parked connection for
+        a worker once the next request starts to arrive, and closes those
+        left idle for longer than idle_timeout """
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_reader, selectors.EVENT_READ)
+        deadlines = {}
+
+        while not self._closing:
+            for (key, _) in selector.select(timeout=1):
+                if key.fileobj is self._wake_reader:
+                    try:
+                        self._wake_reader.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                handler = key.data
+                selector.unregister(handler.connection)
+                del deadlines[handler]
+                try:
+                    self.executor.submit(self.process_request_thread,
+                                         handler.connection,
+                                         handler.client_address, handler)
+                except RuntimeError:
+                    # The server is closing
+                    self._finish(handler, handler.connection)
+
+            while True:
+                try:
+                    handler = self._parking.get_nowait()
+                except queue.Empty:
+                    break
+                selector.register(handler.connection, selectors.EVENT_READ,
+                                  handler)
+                deadlines[handler] = time.monotonic() + self.idle_timeout
+
+            now = time.monotonic()
+            for handler in [handler for (handler, deadline)
+                            in deadlines.items() if deadline <= now]:
+                selector.unregister(handler.connection)
+                del deadlines[handler]
+                self._finish(handler, handler.connection)
+
+        for handler in deadlines:
+            self._finish(handler, handler.connection)
+        selector.close()
+
+    def detach(self, request):
+        """ Leaves a connection open when its handler returns, so the
+        handler can pass it on to be written to later, e.g. by an event
+        stream, without holding a worker thread. Whoever it was passed
+        to must close it. """
+        self._detached.add(request)
+
+    def shutdown_request(self, request):
+        """ Closes a finished connection unless it was detached """
+        if request in self._detached:
+            self._detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._closing = True
+        self._wake()
+        self._idle_thread.join()
+        self._wake_reader.close()
+        self._wake_writer.close()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,9 @@
+from .metrics import METRICS, Metrics, Histogram
+
+from .metrics import start_request, add_sql_time, sql_time
+
+from .sql import TimedConnection, TimedCursor, configure_slow_queries
+
+from .profiling import PROFILER, Profiler, configure_profiling
+
+from .capture import CAPTURE, Capture, configure_capture
@@ -0,0 +1,93 @@
+import json
+import os
+import queue
+import threading
+import time
+
+# Captured requests waiting to be written; past this many, new ones are
+# dropped rather than slowing requests down
+MAX_PENDING = 10000
+
+
+class Capture():
+    """ Appends every request the server answers to a JSONL file, one
+    object per line:
+
+        {"ts": 1760000000.123456, "method": "GET", "path": "/animals",
+         "headers": {...}, "body": null, "status": 200,
+         "duration_ms": 1.234}
+
+    Request threads only put the entry on a queue; a background thread
+    encodes and writes them in batches, each with a single append, so
+    pre-fork workers can share one file without splitting lines.
+
+    Args:
+        path (str): the file to append to, or None to capture nothing
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(MAX_PENDING)
+        self._writer = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def record(self, entry):
+        """ Queues one request to be written """
+        # A forked worker doesn't inherit its parent's writer thread
+        if self._writer_pid != os.getpid():
+            self._start()
+
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._queue = queue.Queue(MAX_PENDING)
+            self._writer = threading.Thread(
+                target=self._write_forever, name="capture", daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+
+    def _write_forever(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        pending = self._queue
+
+        while True:
+            lines = [encode(pending.get())]
+            # Write everything that is already waiting in the same append
+            while len(lines) < 1000:
+                try:
+                    lines.append(encode(pending.get_nowait()))
+                except queue.Empty:
+                    break
+            os.write(fd, ("\n".join(lines) + "\n").encode())
+            for _ in lines:
+                pending.task_done()
+
+    def flush(self, timeout=5):
+        """ Waits, up to timeout seconds, for queued requests to be written """
+        if self._writer_pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+# Shared by every request thread in a process; off until configured
+CAPTURE = Capture()
+
+
+def configure_capture(path):
+    """ Captures every request from now on to path, or stops if None """
+    CAPTURE.path = path
@@ -0,0 +1,208 @@
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Estimated from the buckets each time /metrics is read
+QUANTILES = (0.5, 0.95, 0.99)
+
+# SQL time spent by the request running on each thread
+_local = threading.local()
+
+
+def start_request():
+    """ Starts counting SQL time for a new request on this thread """
+    _local.sql_seconds = 0.0
+
+
+def add_sql_time(seconds):
+    """ Adds time spent in SQLite to the request on this thread """
+    _local.sql_seconds = getattr(_local, "sql_seconds", 0.0) + seconds
+
+
+def sql_time():
+    """ Seconds spent in SQLite by the request on this thread so far """
+    return getattr(_local, "sql_seconds", 0.0)
+
+
+class Histogram():
+    """ Counts observations into the fixed BUCKETS """
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ (upper bound, observations at or below it) for every bucket,
+        ending with +Inf """
+        total = 0
+        result = []
+        for (bound, count) in zip(BUCKETS + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """ Estimates a quantile the way Prometheus' histogram_quantile
+        does, assuming observations are spread evenly inside a bucket """
+        if self.count == 0:
+            return float("nan")
+
+        rank = q * self.count
+        lower = 0.0
+        below = 0
+        for (bound, total) in self.cumulative():
+            if total >= rank:
+                if bound == float("inf"):
+                    return lower
+                inside = total - below
+                return lower + (bound - lower) * (rank - below) / inside
+            (lower, below) = (bound, total)
+        return lower
+
+
+class Metrics():
+    """ Request metrics for this process, written once per request and
+    rendered in the Prometheus text format for /metrics.
+
+    Each request takes one lock for a handful of dictionary updates, so
+    recording costs microseconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.durations = {}
+        self.response_bytes = {}
+        self.sql_seconds = {}
+        self.view_durations = {}
+        self.view_sql = {}
+
+    def record(self, route, method, status, seconds, sent, view=None,
+               sql_seconds=0.0):
+        """ Records one finished request
+
+        Args:
+            route (str): the url pattern, e.g. "/animals/{id}"
+            method (str): e.g. "GET"
+            status (int): the status code sent
+            seconds (float): how long the request took
+            sent (int): body bytes sent
+            view (str): the view function that answered, if any
+            sql_seconds (float): how much of the time was spent in SQLite
+        """
+        key = (route, method)
+        with self._lock:
+            counted = (route, method, status)
+            self.requests[counted] = self.requests.get(counted, 0) + 1
+
+            if key not in self.durations:
+                self.durations[key] = Histogram()
+            self.durations[key].observe(seconds)
+
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + sent
+            self.sql_seconds[key] = \
+                self.sql_seconds.get(key, 0.0) + sql_seconds
+
+            if view is not None:
+                if view not in self.view_durations:
+                    self.view_durations[view] = Histogram()
+                    self.view_sql[view] = Histogram()
+                self.view_durations[view].observe(seconds)
+                self.view_sql[view].observe(sql_seconds)
+
+    def render(self):
+        """ Everything recorded so far in the Prometheus text format """
+        lines = []
+
+        with self._lock:
+            _counter(lines, "kennel_requests_total",
+                     "Requests answered, by route, method and status",
+                     {_labels(route=route, method=method, status=status): value
+                      for ((route, method, status), value)
+                      in self.requests.items()})
+
+            durations = {_labels(route=route, method=method): histogram
+                         for ((route, method), histogram)
+                         in self.durations.items()}
+            _histogram(lines, "kennel_request_duration_seconds",
+                       "Time to answer a request", durations)
+            _quantiles(lines, "kennel_request_duration_quantile_seconds",
+                       "Estimated latency quantiles, from the histogram",
+                       durations)
+
+            _counter(lines, "kennel_response_bytes_total",
+                     "Response body bytes sent",
+                     {_labels(route=route, method=method): value
+                      for ((route, method), value)
+                      in self.response_bytes.items()})
+            _counter(lines, "kennel_sql_seconds_total",
+                     "Time spent executing SQL and reading its rows",
+                     {_labels(route=route, method=method): value
+                      for ((route, method), value)
+                      in self.sql_seconds.items()})
+
+            views = {_labels(view=view): histogram
+                     for (view, histogram) in self.view_durations.items()}
+            _histogram(lines, "kennel_view_duration_seconds",
+                       "Time to answer a request, by the view that answered",
+                       views)
+            _quantiles(lines, "kennel_view_duration_quantile_seconds",
+                       "Estimated latency quantiles by view", views)
+            _histogram(lines, "kennel_view_sql_seconds",
+                       "SQL time per request, by the view that answered",
+                       {_labels(view=view): histogram
+                        for (view, histogram) in self.view_sql.items()})
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{value}"' for (name, value) in labels.items())
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _counter(lines, name, help, values):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} counter")
+    for (labels, value) in sorted(values.items()):
+        lines.append(f"{name}{{{labels}}} {_number(value)}")
+
+
+def _histogram(lines, name, help, histograms):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} histogram")
+    for (labels, histogram) in sorted(histograms.items()):
+        for (bound, total) in histogram.cumulative():
+            lines.append(
+                f'{name}_bucket{{{labels},le="{_number(bound)}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+def _quantiles(lines, name, help, histograms):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} gauge")
+    for (labels, histogram) in sorted(histograms.items()):
+        for q in QUANTILES:
+            lines.append(f'{name}{{{labels},quantile="{q}"}} '
+                         f'{_number(histogram.quantile(q))}')
+
+
+# Shared by every request thread in a process
+METRICS = Metrics()
@@ -0,0 +1,86 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+
+
+class Profiler():
+    """ Runs cProfile on a random sample of requests and keeps one pstats
+    file per route, adding every sampled request to it.
+
+    Only one request is profiled at a time, since Python allows only one
+    active profiler; a request sampled while another is being profiled
+    is simply not profiled.
+
+    Args:
+        rate (float): the share of requests to profile, from 0 to 1
+        directory (str): where the .pstats files are written
+    """
+
+    def __init__(self, rate=0.0, directory="profiles"):
+        self.rate = rate
+        self.directory = directory
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def start(self):
+        """ Starts profiling the current request if it is sampled
+
+        Returns:
+            cProfile.Profile: pass it to finish(), or None if this request
+                is not profiled
+        """
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Something else, e.g. a debugger, is already profiling
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, route):
+        """ Stops a profile and adds it to the route's pstats file
+
+        Args:
+            profile (cProfile.Profile): what start() returned
+            route (str): the route the request was counted under
+        """
+        profile.disable()
+        self._busy.release()
+
+        with self._lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                stats = self._stats[route] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+            os.makedirs(self.directory, exist_ok=True)
+            stats.dump_stats(self.path_for(route))
+
+    def path_for(self, route):
+        """ The pstats file for a route, e.g. profiles/animals_id.1234.pstats
+
+        The process id keeps pre-fork workers from writing the same file.
+        """
+        name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        return os.path.join(self.directory, f"{name}.{os.getpid()}.pstats")
+
+
+# Shared by every request thread in a process; off until configured
+PROFILER = Profiler()
+
+
+def configure_profiling(rate, directory="profiles"):
+    """ Profiles this share of requests from now on, writing to directory """
+    PROFILER.rate = rate
+    PROFILER.directory = directory
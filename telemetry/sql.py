@@ -0,0 +1,108 @@
+import logging
+import sqlite3
+import time
+
+from .metrics import add_sql_time
+
+# Statements that take longer than this are logged; None logs none
+_slow_query = {"seconds": None}
+
+slow_query_log = logging.getLogger("kennel.slow_queries")
+
+
+def configure_slow_queries(seconds, path=None):
+    """ Logs every statement slower than a threshold, with its SQL,
+    parameters and duration.
+
+    Args:
+        seconds (float): the threshold, or None to stop logging
+        path (str): a file to append the log to; stderr if None
+    """
+    _slow_query["seconds"] = seconds
+
+    for handler in list(slow_query_log.handlers):
+        slow_query_log.removeHandler(handler)
+        handler.close()
+
+    if seconds is not None:
+        handler = logging.FileHandler(path) if path else \
+            logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_log.addHandler(handler)
+        slow_query_log.setLevel(logging.WARNING)
+        slow_query_log.propagate = False
+
+
+def _timed(seconds, sql, params):
+    """ Counts a statement's time and logs it if it was slow """
+    add_sql_time(seconds)
+
+    threshold = _slow_query["seconds"]
+    if threshold is not None and seconds >= threshold:
+        slow_query_log.warning(
+            "slow query %.1f ms: %s params=%r",
+            seconds * 1000, " ".join(sql.split()), params)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """ A cursor that adds the time spent executing statements and
+    fetching their rows to the current request's SQL time, and logs
+    statements slower than the configured threshold.
+
+    Rows read by iterating over the cursor are not timed, since timing
+    every row would cost more than reading it; read them with
+    fetchmany() or fetchall() instead.
+    """
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _timed(time.perf_counter() - start, sql, params)
+
+    def executemany(self, sql, rows):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, rows)
+        finally:
+            # Only the number of rows is logged, not every one of them
+            _timed(time.perf_counter() - start, sql,
+                   f"<{len(rows) if hasattr(rows, '__len__') else '?'} rows>")
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_sql_time(time.perf_counter() - start)
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_sql_time(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_sql_time(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """ A connection whose cursors are TimedCursors, including the ones
+    conn.execute() makes. Pass it as sqlite3.connect(factory=...). """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3 doesn't go through cursor() for these, so they are
+    # routed there by hand
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.cursor().executemany(sql, rows)
@@ -0,0 +1,466 @@
+import gzip
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import change_feed
+import compression
+import database
+from database import changes
+from database.importer import import_file
+from database.migrations import migrate
+from request_handler import HandleRequests
+from servers import PooledHTTPServer
+from views import ROUTES
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)), "kennel.sql")
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Starts the real server, on a free port, on a new database made
+    from kennel.sql with every migration applied """
+
+    replica = False
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "kennel.sqlite3")
+        conn = sqlite3.connect(self.path)
+        with open(SCHEMA, encoding="utf-8") as schema:
+            conn.executescript(schema.read())
+        conn.close()
+        migrate(self.path)
+
+        self.addCleanup(database.configure,
+                        database=database.connection._settings["database"],
+                        size=database.connection._settings["size"],
+                        replica=database.connection._settings["replica"])
+        database.configure(database=self.path, size=4, replica=self.replica)
+
+        # Keeps the request log off the test output
+        patcher = mock.patch.object(HandleRequests, "log_message")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = PooledHTTPServer(("127.0.0.1", 0), HandleRequests,
+                                       workers=4)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={"poll_interval": 0.05})
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+
+    def request(self, method, path, body=None, headers=None):
+        """ Sends one request on a new connection
+
+        Returns:
+            tuple: (status, headers, body), where body is decoded JSON, or
+                the raw bytes if it isn't JSON
+        """
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            if body is not None:
+                body = json.dumps(body)
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+
+        if response.getheader("Content-Encoding") == "gzip":
+            return (response.status, response, data)
+        try:
+            data = json.loads(data)
+        except ValueError:
+            pass
+        return (response.status, response, data)
+
+    def get(self, path, headers=None):
+        return self.request("GET", path, headers=headers)
+
+    def ids(self, path):
+        (status, _, body) = self.get(path)
+        self.assertEqual(status, 200, body)
+        return [entity["id"] for entity in body]
+
+
+class PaginationTest(ServerTestCase):
+
+    def test_pages_follow_the_cursor(self):
+        (status, response, body) = self.get("/animals?limit=3")
+        self.assertEqual([animal["id"] for animal in body], [1, 2, 3])
+        self.assertEqual(response.getheader("X-Next-Cursor"), "3")
+        self.assertEqual(response.getheader("Link"),
+                         '</animals?limit=3&after=3>; rel="next"')
+
+        self.assertEqual(self.ids("/animals?limit=3&after=3"), [4, 5, 6])
+
+        (status, response, body) = self.get("/animals?limit=3&after=6")
+        self.assertEqual([animal["id"] for animal in body], [7, 8])
+        self.assertIsNone(response.getheader("X-Next-Cursor"))
+
+    def test_pages_of_a_filtered_list(self):
+        (_, response, body) = self.get("/animals?status=Kennel&limit=2")
+        self.assertEqual([animal["id"] for animal in body], [4, 5])
+        self.assertEqual(response.getheader("X-Next-Cursor"), "5")
+        self.assertEqual(
+            self.ids("/animals?status=Kennel&limit=2&after=5"), [6, 7])
+        self.assertEqual(
+            self.ids("/animals?status=Kennel&limit=2&after=7"), [])
+
+    def test_bad_limit_or_cursor(self):
+        for query in ("limit=0", "limit=ten", "after=x"):
+            (status, _, _) = self.get(f"/animals?{query}")
+            self.assertEqual(status, 400, query)
+
+
+class FilterTest(ServerTestCase):
+
+    def test_filters_are_combined(self):
+        self.assertEqual(self.ids("/animals?status=Kennel"), [4, 5, 6, 7])
+        self.assertEqual(
+            self.ids("/animals?location_id=2&status=Kennel"), [5, 6, 7])
+        self.assertEqual(
+            self.ids("/animals?status=Kennel&status=Treatment"),
+            [2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(self.ids("/employees?location_id=2"), [3, 5])
+        self.assertEqual(self.ids("/customers?email=mo@silvera.com"), [1])
+
+    def test_unknown_filter_answers_400(self):
+        (status, _, body) = self.get("/animals?colour=brown")
+        self.assertEqual(status, 400)
+        self.assertIn("colour", body["message"])
+
+    def test_underscore_parameters_are_left_for_the_client(self):
+        self.assertEqual(self.ids("/locations?_t=123"), [1, 2])
+
+
+class GetByIdTest(ServerTestCase):
+
+    def test_ids_come_in_the_order_asked_for(self):
+        (status, response, body) = self.get("/animals?id=3,1,99,98")
+        self.assertEqual(status, 200)
+        self.assertEqual([animal["id"] for animal in body], [3, 1])
+        self.assertEqual(response.getheader("X-Missing-Ids"), "99,98")
+
+    def test_no_missing_ids_header_when_all_exist(self):
+        (_, response, _) = self.get("/customers?id=1,2")
+        self.assertIsNone(response.getheader("X-Missing-Ids"))
+
+    def test_expand_goes_with_id(self):
+        (_, _, body) = self.get("/animals?id=2&_expand=location")
+        self.assertEqual(body[0]["location"]["name"], "Nashville North")
+
+    def test_id_with_filters_or_paging_answers_400(self):
+        for query in ("id=1&status=Kennel", "id=1&limit=2", "id=1,x"):
+            (status, _, _) = self.get(f"/animals?{query}")
+            self.assertEqual(status, 400, query)
+
+
+class SearchTest(ServerTestCase):
+
+    def test_every_word_starts_a_word(self):
+        self.assertEqual(sorted(self.ids("/animals?q=bea")), [2, 7])
+        self.assertEqual(self.ids("/animals?q=snick%20dal"), [1])
+        self.assertEqual(self.ids("/customers?q=mulberry"), [4])
+
+    def test_new_entities_are_found(self):
+        (status, _, _) = self.request("POST", "/animals", {
+            "name": "Biscuit", "breed": "Beagle", "status": "Kennel",
+            "locationId": 1, "customerId": 2})
+        self.assertEqual(status, 201)
+        self.assertEqual(self.ids("/animals?q=biscuit"), [9])
+
+    def test_resource_without_search_answers_400(self):
+        (status, _, _) = self.get("/locations?q=nashville")
+        self.assertEqual(status, 400)
+
+
+class ConditionalRequestTest(ServerTestCase):
+
+    def etag(self, path):
+        (status, response, _) = self.get(path)
+        self.assertEqual(status, 200)
+        return response.getheader("ETag")
+
+    def test_matching_etag_answers_304(self):
+        etag = self.etag("/animals")
+        (status, response, body) = self.get(
+            "/animals", {"If-None-Match": etag})
+        self.assertEqual(status, 304)
+        self.assertEqual(response.getheader("ETag"), etag)
+        self.assertEqual(body, b"")
+
+    def test_write_changes_the_etag(self):
+        etag = self.etag("/animals/1")
+        other = self.etag("/animals/2")
+        (status, _, _) = self.request("PUT", "/animals/1", {
+            "name": "Snickers", "breed": "Dalmation", "status": "Kennel",
+            "locationId": 1, "customerId": 4})
+        self.assertEqual(status, 204)
+
+        (status, _, _) = self.get("/animals/1", {"If-None-Match": etag})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.etag("/animals/2"), other)
+
+    def test_change_to_an_embedded_resource_changes_the_list(self):
+        animals = self.etag("/animals")
+        customers = self.etag("/customers")
+        (status, _, _) = self.request("PUT", "/locations/1", {
+            "name": "Nashville North", "address": "65 Washington Heights"})
+        self.assertEqual(status, 204)
+
+        self.assertNotEqual(self.etag("/animals"), animals)
+        self.assertEqual(self.etag("/customers"), customers)
+        (status, _, _) = self.get("/animals", {"If-None-Match": animals})
+        self.assertEqual(status, 200)
+
+
+class CompressionTest(ServerTestCase):
+
+    url = "/animals?_expand=location,customer"
+
+    def test_compressed_response_is_cached(self):
+        headers = {"Accept-Encoding": "gzip"}
+        (status, response, first) = self.get(self.url, headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        etag = response.getheader("ETag")
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(len(json.loads(gzip.decompress(first))), 8)
+        self.assertIsNotNone(compression.RESPONSE_CACHE.get(
+            (self.url, etag[2:], "gzip")))
+
+        # The second is sent from the cache, without calling the view
+        def not_called(*args):
+            raise AssertionError("the view was called")
+
+        with mock.patch.object(ROUTES["animals"], "iter_all", not_called):
+            (status, response, second) = self.get(self.url, headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(second, first)
+        self.assertEqual(response.getheader("ETag"), etag)
+
+    def test_write_misses_the_cache(self):
+        headers = {"Accept-Encoding": "gzip"}
+        (_, _, first) = self.get(self.url, headers)
+        self.request("PUT", "/customers/4", {
+            "name": "Emily Lemmon", "address": "455 Mulberry Way",
+            "email": "emily@lemmon.com", "password": "password"})
+
+        (_, _, second) = self.get(self.url, headers)
+        self.assertNotEqual(second, first)
+        self.assertIn(b"455 Mulberry Way", gzip.decompress(second))
+
+    def test_small_responses_are_not_compressed(self):
+        (_, response, body) = self.get("/locations/1",
+                                       {"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual(body["id"], 1)
+
+
+class WriteTest(ServerTestCase):
+
+    def test_delete_of_a_missing_id_answers_404(self):
+        (status, _, _) = self.request("DELETE", "/animals/99")
+        self.assertEqual(status, 404)
+        (status, _, _) = self.request("DELETE", "/animals/7")
+        self.assertEqual(status, 204)
+        (status, _, _) = self.get("/animals/7")
+        self.assertEqual(status, 404)
+
+    def test_busy_database_answers_503(self):
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        with mock.patch.object(ROUTES["locations"], "create", locked):
+            (status, response, _) = self.request("POST", "/locations", {
+                "name": "East", "address": "1 St"})
+        self.assertEqual(status, 503)
+        self.assertIsNotNone(response.getheader("Retry-After"))
+
+
+class ChangeFeedTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The feed remembers the last change id it saw, which belongs to
+        # another test's database
+        patcher = mock.patch.object(change_feed, "FEED",
+                                    change_feed.ChangeFeed())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def listen(self, path="/changes", headers=None):
+        """ Opens an event stream and reads past its response headers
+
+        Returns:
+            file: the stream, to read events from
+        """
+        sock = socket.create_connection(("127.0.0.1", self.port), timeout=5)
+        self.addCleanup(sock.close)
+        lines = [f"GET {path} HTTP/1.1", "Host: localhost"]
+        lines += [f"{name}: {value}"
+                  for (name, value) in (headers or {}).items()]
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+        stream = sock.makefile("rb")
+        self.addCleanup(stream.close)
+        self.assertIn(b" 200 ", stream.readline())
+        while stream.readline() not in (b"\r\n", b""):
+            pass
+        return stream
+
+    def next_event(self, stream):
+        """ The next event's (id, data), skipping comments and retry """
+        event = {}
+        while True:
+            line = stream.readline()
+            self.assertNotEqual(line, b"", "the stream closed")
+            line = line.decode().rstrip("\n")
+            if not line:
+                if "id" in event:
+                    return (int(event["id"]), json.loads(event["data"]))
+                event = {}
+                continue
+            (name, _, value) = line.partition(": ")
+            event[name] = value
+
+    def test_writes_are_sent_as_they_commit(self):
+        stream = self.listen("/changes?resource=customers")
+        self.request("POST", "/locations", {"name": "East", "address": "1 St"})
+        self.request("PUT", "/customers/2", {
+            "name": "Bryan Nilsen", "address": "500 Internal Error Blvd",
+            "email": "bryan@nilsen.com", "password": "secret"})
+
+        (id, data) = self.next_event(stream)
+        self.assertEqual(id, changes.last_change_id())
+        self.assertEqual(data, {"resource": "customers", "id": 2,
+                                "action": "update"})
+
+    def test_last_event_id_sends_the_missed_changes_first(self):
+        self.request("DELETE", "/animals/1")
+        first = changes.last_change_id()
+        self.request("DELETE", "/animals/2")
+        self.request("DELETE", "/animals/3")
+
+        stream = self.listen(headers={"Last-Event-ID": first})
+        self.assertEqual(self.next_event(stream), (first + 1, {
+            "resource": "animals", "id": 2, "action": "delete"}))
+        self.assertEqual(self.next_event(stream), (first + 2, {
+            "resource": "animals", "id": 3, "action": "delete"}))
+
+        self.request("DELETE", "/animals/4")
+        self.assertEqual(self.next_event(stream)[0], first + 3)
+
+    def test_bad_last_event_id_answers_400(self):
+        (status, _, _) = self.get("/changes", {"Last-Event-ID": "x"})
+        self.assertEqual(status, 400)
+
+
+class ReplicaTest(ServerTestCase):
+
+    replica = True
+
+    def test_reads_see_committed_writes(self):
+        (status, _, body) = self.request("POST", "/locations", {
+            "name": "East", "address": "1 St"})
+        self.assertEqual(status, 201)
+        (status, _, location) = self.get(f"/locations/{body['id']}")
+        self.assertEqual(location["name"], "East")
+
+        self.request("DELETE", "/employees/5")
+        self.assertEqual(self.ids("/employees?location_id=2"), [3])
+        self.assertEqual(database.get_replica().check(), {})
+
+    def test_reads_never_see_half_a_write(self):
+        # Each bulk PUT gives both animals the same new name; a read that
+        # saw one renamed but not the other would have seen half of it
+        def rename_both(name):
+            return self.request("PUT", "/animals", [
+                {"id": id, "name": name, "breed": "Lab", "status": "Kennel",
+                 "locationId": 1, "customerId": 1}
+                for id in (1, 2)])[0]
+
+        self.assertEqual(rename_both("Rex"), 204)
+        stop = threading.Event()
+        self.addCleanup(stop.set)
+        failures = []
+
+        def rename_until_stopped():
+            number = 0
+            while not stop.is_set():
+                number += 1
+                rename_both(f"Rex {number}")
+
+        writer = threading.Thread(target=rename_until_stopped)
+        writer.start()
+        self.addCleanup(writer.join, 5)
+        try:
+            for _ in range(100):
+                (_, _, body) = self.get("/animals?id=1,2")
+                names = {animal["name"] for animal in body}
+                if len(names) != 1:
+                    failures.append(names)
+        finally:
+            stop.set()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(database.get_replica().check(), {})
+
+
+class ImportTest(ServerTestCase):
+
+    def etag(self, path):
+        return self.get(path)[1].getheader("ETag")
+
+    def test_import_changes_the_etag(self):
+        etag = self.etag("/locations")
+        source = os.path.join(os.path.dirname(self.path), "locations.jsonl")
+        with open(source, "w", encoding="utf-8") as lines:
+            lines.write('{"name": "East", "address": "1 St"}\n'
+                        '{"name": "West", "address": "2 St"}\n')
+        self.assertEqual(import_file(source, "locations", database=self.path),
+                         (2, []))
+
+        (status, _, body) = self.get("/locations", {"If-None-Match": etag})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body), 4)
+
+    def test_changes_made_elsewhere_get_new_etags(self):
+        after = changes.last_change_id()
+        etag = self.etag("/animals/3")
+        other = self.etag("/animals/4")
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("UPDATE Animal SET name = 'Hummus' WHERE id = 3")
+        conn.close()
+
+        self.assertEqual(changes.bump_versions(after), after + 1)
+        self.assertNotEqual(self.etag("/animals/3"), etag)
+        self.assertEqual(self.etag("/animals/4"), other)
+        self.assertEqual(changes.bump_versions(after + 1), after + 1)
+
+    def test_dropped_indexes_are_made_again(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("DROP INDEX animal_status")
+        conn.close()
+        migrate(self.path)
+
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        self.assertIsNotNone(conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'animal_status'"
+        ).fetchone())
+
+
+if __name__ == "__main__":
+    unittest.main()
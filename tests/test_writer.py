@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import database
+import telemetry
+from database import writer
+from database.writer import Writer
+
+
+def insert(value):
+    """ A write that inserts one row and returns its id """
+    def job(conn, replicate):
+        return conn.execute("INSERT INTO t (x) VALUES (?)", (value, )).lastrowid
+    return job
+
+
+def insert_then_fail(value):
+    """ A write that inserts one row and then raises """
+    def job(conn, replicate):
+        conn.execute("INSERT INTO t (x) VALUES (?)", (value, ))
+        raise ValueError(f"{value} is bad")
+    return job
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "test.sqlite3")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, x TEXT)")
+        conn.close()
+
+    def start_writer(self, **options):
+        started = Writer(self.path, **options)
+        self.addCleanup(started._thread.join, 5)
+        self.addCleanup(started.close)
+        return started
+
+    def values(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return [x for (x, ) in conn.execute("SELECT x FROM t ORDER BY id")]
+        finally:
+            conn.close()
+
+    def submit_in_batch(self, started, jobs):
+        """ Submits every job from its own thread while the writer is held
+        up, so they are all committed in one batch
+
+        Returns:
+            list: what each submit returned or raised, in order
+        """
+        (running, release) = (threading.Event(), threading.Event())
+        results = [None] * len(jobs)
+
+        def hold(conn, replicate):
+            running.set()
+            release.wait(5)
+
+        def submit(index, job):
+            try:
+                results[index] = started.submit(job)
+            except Exception as ex:
+                results[index] = ex
+
+        holder = threading.Thread(target=started.submit, args=(hold, ))
+        holder.start()
+        running.wait(5)
+        threads = [threading.Thread(target=submit, args=(index, job))
+                   for (index, job) in enumerate(jobs)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while started._queue.qsize() < len(jobs) \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads + [holder]:
+            thread.join(5)
+        return results
+
+    def test_returns_what_the_job_returns(self):
+        started = self.start_writer()
+        self.assertEqual(started.submit(insert("a")), 1)
+        self.assertEqual(self.values(), ["a"])
+
+    def test_failed_write_is_rolled_back_alone(self):
+        started = self.start_writer()
+        results = self.submit_in_batch(
+            started, [insert("a"), insert_then_fail("b"), insert("c")])
+
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(str(results[1]), "b is bad")
+        self.assertEqual(self.values(), ["a", "c"])
+        self.assertNotIsInstance(results[0], Exception)
+        self.assertNotIsInstance(results[2], Exception)
+
+    def test_failed_write_raises_to_its_caller(self):
+        started = self.start_writer()
+        with self.assertRaises(ValueError):
+            started.submit(insert_then_fail("b"))
+        self.assertEqual(self.values(), [])
+
+    def test_writes_after_a_failed_one_are_committed(self):
+        started = self.start_writer()
+        with self.assertRaises(ValueError):
+            started.submit(insert_then_fail("b"))
+        started.submit(insert("a"))
+        self.assertEqual(self.values(), ["a"])
+
+    def test_constraint_error_fails_only_its_write(self):
+        started = self.start_writer()
+        started.submit(insert("a"))
+
+        def duplicate(conn, replicate):
+            conn.execute("INSERT INTO t (id, x) VALUES (1, 'again')")
+
+        results = self.submit_in_batch(started, [duplicate, insert("b")])
+        self.assertIsInstance(results[0], sqlite3.IntegrityError)
+        self.assertEqual(self.values(), ["a", "b"])
+
+    def test_batch_error_reaches_every_write_and_writer_carries_on(self):
+        started = self.start_writer()
+        calls = []
+
+        def failing_get_replica():
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("replica is gone")
+
+        with mock.patch.object(writer, "get_replica", failing_get_replica):
+            with self.assertRaises(sqlite3.OperationalError):
+                started.submit(insert("a"))
+            self.assertTrue(started.is_alive())
+            self.assertEqual(started.submit(insert("b")), 1)
+
+        self.assertEqual(self.values(), ["b"])
+
+    def test_sql_time_is_counted_for_the_caller(self):
+        started = self.start_writer()
+
+        def slow(conn, replicate):
+            conn.create_function("pause", 0, lambda: time.sleep(0.05))
+            conn.execute("SELECT pause()")
+
+        telemetry.start_request()
+        started.submit(slow)
+        self.assertGreaterEqual(telemetry.sql_time(), 0.05)
+
+    def test_submit_times_out(self):
+        started = self.start_writer(submit_timeout=0.1)
+        (running, release) = (threading.Event(), threading.Event())
+        self.addCleanup(release.set)
+
+        def hold(conn, replicate):
+            running.set()
+            release.wait(5)
+
+        def submit_hold():
+            # Whether this one times out too depends on when its thread
+            # starts waiting, which the test doesn't control
+            try:
+                started.submit(hold)
+            except sqlite3.OperationalError:
+                pass
+
+        holder = threading.Thread(target=submit_hold)
+        holder.start()
+        self.addCleanup(holder.join, 5)
+        running.wait(5)
+        with self.assertRaises(sqlite3.OperationalError):
+            started.submit(insert("late"))
+        release.set()
+
+        # The write that timed out while waiting is never run
+        started.submit_timeout = 5
+        started.submit(insert("a"))
+        self.assertEqual(self.values(), ["a"])
+
+
+class GetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "test.sqlite3")
+        sqlite3.connect(path).close()
+
+        self.addCleanup(database.configure,
+                        database=database.connection._settings["database"])
+        database.configure(database=path)
+
+    def test_restarts_a_stopped_writer(self):
+        first = writer.get_writer()
+        first.close()
+        first._thread.join(5)
+
+        second = writer.get_writer()
+        self.assertIsNot(first, second)
+        self.assertTrue(second.is_alive())
+        second.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
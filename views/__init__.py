@@ -15,3 +15,35 @@ from .employee_requests import delete_employee, update_employee, get_employee_by
 from .customer_requests import get_all_customers, get_single_customer, create_customer
 
 from .customer_requests import delete_customer, update_customer, get_customer_by_email
+
+from .animal_requests import iter_all_animals
+
+from .location_requests import iter_all_locations
+
+from .employee_requests import iter_all_employees
+
+from .customer_requests import iter_all_customers
+
+from .animal_requests import create_animals, update_animals
+
+from .location_requests import create_locations, update_locations
+
+from .employee_requests import create_employees, update_employees
+
+from .customer_requests import create_customers, update_customers
+
+from .animal_requests import get_animals_by_id
+
+from .location_requests import get_locations_by_id
+
+from .employee_requests import get_employees_by_id
+
+from .customer_requests import get_customers_by_id
+
+from .animal_requests import search_animals
+
+from .customer_requests import search_customers
+
+from .stats_requests import get_stats
+
+from .routes import Route, ROUTES
@@ -1,245 +1,144 @@
-import sqlite3
-import json
-from models import Animal
-from models import Location
-from models import Customer
-
-
-def get_all_animals():
-    """ Gets all animals """
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-       SELECT
-            a.id,
-            a.name,
-            a.breed,
-            a.status,
-            a.location_id, 
-            a.customer_id,  
-            l.name AS location_name,
-            l.address AS location_address,
-            c.name AS customer_name,
-            c.address AS customer_address,
-            c.email AS customer_email,
-            c.password AS customer_password
-        FROM Animal a
-        JOIN Location l ON l.id = a.location_id
-        JOIN Customer c ON c.id = a.customer_id""")
-
-
-        # Initialize an empty list to hold all animal representations
-        animals = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-            # Create a Location instance from the current row
-            location = Location(
-                row['location_id'],
-                row['location_name'],
-                row['location_address']
-            )
-
-            # Create a Customer instance from the current row
-            customer = Customer(
-                row['customer_id'],
-                row['customer_name'],
-                row['customer_address'],
-                row['customer_email'],
-                row['customer_password']
-            )
-
-            # Create an animal instance from the current row
-            animal = Animal(
-                row['id'],
-                row['name'],
-                row['breed'],
-                row['status'],
-                row['customer_id'],  # Swap location_id with customer_id
-                row['location_id'],  # Swap customer_id with location_id
-            )
-
-            # Add the dictionary representation of the location to the animal
-            animal.location = location.__dict__
-
-            # Add the dictionary representation of the customer to the animal
-            animal.customer = customer.__dict__
-
-            # Add the dictionary representation of the animal to the list
-            animals.append(animal.__dict__)
-
-    return animals
-
-
-
-def get_single_animal(id):
-    """ Gets a single animal and additional details """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute("""
-        SELECT
-            a.id,
-            a.name,
-            a.breed,
-            a.status,
-            a.location_id,
-            a.customer_id
-        FROM Animal a
-        WHERE a.id = ?
-        """, (id, ))
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an animal instance from the current row
-        animal = Animal(data['id'], data['name'], data['breed'],
-                        data['status'], data['location_id'],
-                        data['customer_id'])
-
-        return animal.__dict__
+from database import repository
+from database.entities import ANIMAL
+
+
+def iter_all_animals(limit=None, after=None, encoded=False,
+                     expand=(), filters=None):
+    """ Yields all animals, or one page of them
+
+    Args:
+        limit (int): the most animals to return, all of them if None
+        after (int): only return animals whose id is greater than this
+        encoded (bool): yield JSON text, several rows at a time, instead
+            of dictionaries
+        expand (tuple): relations to attach to each animal, e.g.
+            ("location", "customer"); the others are None
+        filters (dict): column -> the value, or list of values, the
+            animals must have
+    """
+    return repository.iter_rows(ANIMAL, limit, after, filters,
+                                expand=expand, encoded=encoded)
+
+
+def get_all_animals(limit=None, after=None, expand=(), filters=None):
+    """ Same as iter_all_animals, collected into a list """
+    return list(iter_all_animals(limit, after, expand=expand,
+                                 filters=filters))
+
+
+def get_single_animal(id, expand=()):
+    """ Gets a single animal, or None if there isn't one with that id """
+    return repository.get_row(ANIMAL, id, expand=expand)
+
+
+def get_animals_by_id(ids, expand=()):
+    """ Gets the animals with any of a list of ids in one query
+
+    Args:
+        ids (list): the ids to look up, in the order to return them
+
+    Returns:
+        tuple: (the animals found, in the order asked for, and the ids
+            with no animal)
+    """
+    return repository.get_rows(ANIMAL, ids, expand=expand)
+
+
+def search_animals(text, limit=None, offset=0, expand=(), filters=None):
+    """ Finds the animals whose name or breed has words starting with every
+    word in text, best match first
+
+    Args:
+        text (str): what was typed, e.g. "bea"
+        limit (int): the most animals to return
+        offset (int): how many of the best matches to skip
+        expand (tuple): relations to attach to each animal
+        filters (dict): column -> the value, or list of values, the
+            animals must have
+    """
+    return repository.search_rows(
+        ANIMAL, text, limit or repository.DEFAULT_SEARCH_LIMIT, offset,
+        filters, expand)
 
 
 def create_animal(new_animal):
     """ Creates new animal """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        INSERT INTO Animal
-            ( name, breed, status, location_id, customer_id )
-        VALUES
-            ( ?, ?, ?, ?, ?);
-        """, (new_animal['name'],  new_animal['breed'],
-              new_animal['status'], new_animal['locationId'],
-              new_animal['customerId'], ))
-
-        # The `lastrowid` property on the cursor will return
-        # the primary key of the last thing that got added to
-        # the database.
-        id = db_cursor.lastrowidD
-
-        # Add the `id` property to the animal dictionary that
-        # was sent by the client so that the client sees the
-        # primary key in the response.
-        new_animal['id'] = id
+    # Add the `id` property to the animal dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_animal['id'] = repository.insert(ANIMAL, new_animal)
 
     return new_animal
 
 
+def create_animals(new_animals):
+    """ Creates many animals in one transaction
+
+    Args:
+        new_animals (list): the animal dictionaries sent by the client
+
+    Returns:
+        list: the same dictionaries, each with its new `id` added
+    """
+    ids = repository.insert_many(ANIMAL, new_animals)
+
+    for (animal, id) in zip(new_animals, ids):
+        animal['id'] = id
+
+    return new_animals
+
 
 def delete_animal(id):
-    """ Deletes animal """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    """ Deletes animal
 
-        db_cursor.execute("""
-        DELETE FROM Animal
-        WHERE id = ?
-        """, (id, ))
+    Returns:
+        bool: False if there is no animal with that id, which forces a
+            404 response by the main module
+    """
+    return repository.delete(ANIMAL, id)
 
 
 def update_animal(id, new_animal):
-    """ Updates an animal """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        UPDATE Animal
-            SET
-                name = ?,
-                breed = ?,
-                status = ?,
-                location_id = ?,
-                customer_id = ?
-        WHERE id = ?
-        """, (new_animal['name'], new_animal['breed'],
-              new_animal['status'], new_animal['locationId'],
-              new_animal['customerId'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
-
-    if rows_affected == 0:
-        # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True
-
-
-def get_animal_by_location(location_id):
-    """ Gets an animal by their location_id """
-
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        select
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.location_id,
-            a.customer_id
-        from Animal a
-        WHERE a.location_id = ?
-        """, (location_id, ))
-
-        animals = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            customer = Animal(
-                row['id'], row['name'], row['status'], row['breed'],
-                row['location_id'], row['customer_id'])
-            animals.append(customer.__dict__)
-
-    return animals
-
-
-def get_animal_by_status(status):
-    """ Gets a customer by their status """
-
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        select
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.location_id,
-            a.customer_id
-        from Animal a
-        WHERE a.status = ?
-        """, (status, ))
-
-        animals = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            animal = Animal(
-                row['id'], row['name'], row['status'], row['breed'],
-                row['location_id'], row['customer_id'])
-            animals.append(animal.__dict__)
-
-    return animals
+    """ Updates an animal
+
+    Returns:
+        bool: False if there is no animal with that id, which forces a
+            404 response by the main module
+    """
+    return repository.update(ANIMAL, id, new_animal)
+
+
+def update_animals(new_animals):
+    """ Updates many animals in one transaction, each identified by the
+    `id` in its dictionary. Nothing is changed if any of them is missing.
+
+    Returns:
+        list: the ids that don't exist, which forces a 404 response by
+            the main module; empty when every animal was updated
+    """
+    return repository.update_many(ANIMAL, new_animals)
+
+
+def get_animal_by_location(location_id, limit=None, after=None, expand=()):
+    """ Gets the animals at a location_id
+
+    Args:
+        limit (int): the most animals to return, all of them if None
+        after (int): only return animals whose id is greater than this
+        expand (tuple): relations to attach to each animal
+    """
+    return list(repository.iter_rows(ANIMAL, limit, after,
+                                     {"location_id": location_id},
+                                     expand=expand))
+
+
+def get_animal_by_status(status, limit=None, after=None, expand=()):
+    """ Gets the animals with a status
+
+    Args:
+        limit (int): the most animals to return, all of them if None
+        after (int): only return animals whose id is greater than this
+        expand (tuple): relations to attach to each animal
+    """
+    return list(repository.iter_rows(ANIMAL, limit, after,
+                                     {"status": status}, expand=expand))
@@ -1,179 +1,128 @@
-import sqlite3
-import json
-from models import Customer
-
-CUSTOMERS = [
-    {
-        "id": 1,
-        "name": "Ryan Tanay",
-        "address": "185 Richmond Dr.",
-        "email": "ryantanay@gmail.com",
-        "password": "ryantanay"
-    }
-]
-
-
-def get_all_customers():
-    """ Gets all customers """
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        SELECT
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        FROM Customer c
-        """)
-
-        # Initialize an empty list to hold all customer representations
-        customers = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-
-            # Create an customer instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Customer class above.
-            customer = Customer(row['id'], row['name'], row['address'],
-                                row['email'], row['password'])
-
-            customers.append(customer.__dict__)
-
-    return customers
-
-# Function with a single parameter
-
-
-def get_single_customer(id):
-    """ Gets a single customer and additional details """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute("""
-        SELECT
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        FROM customer c
-        WHERE c.id = ?
-        """, (id, ))
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an customer instance from the current row
-        customer = Customer(data['id'], data['name'], data['address'],
-                            data['email'], data['password'])
-
-        return customer.__dict__
+from database import repository
+from database.entities import CUSTOMER
 
 
-def create_customer(customer):
-    """ Creates customer """
-    # Get the id value of the last customer in the list
-    max_id = CUSTOMERS[-1]["id"]
+def iter_all_customers(limit=None, after=None, encoded=False,
+                       expand=(), filters=None):
+    """ Yields all customers, or one page of them
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    Args:
+        limit (int): the most customers to return, all of them if None
+        after (int): only return customers whose id is greater than this
+        encoded (bool): yield JSON text, several rows at a time, instead
+            of dictionaries
+        expand (tuple): relations to attach; customers have none
+        filters (dict): column -> the value, or list of values, the
+            customers must have
+    """
+    return repository.iter_rows(CUSTOMER, limit, after, filters,
+                                expand=expand, encoded=encoded)
 
-    # Add an `id` property to the customer dictionary
-    customer["id"] = new_id
 
-    # Add the customer dictionary to the list
-    CUSTOMERS.append(customer)
+def get_all_customers(limit=None, after=None, expand=(), filters=None):
+    """ Same as iter_all_customers, collected into a list """
+    return list(iter_all_customers(limit, after, expand=expand,
+                                   filters=filters))
+
+
+def get_single_customer(id, expand=()):
+    """ Gets a single customer, or None if there isn't one with that id """
+    return repository.get_row(CUSTOMER, id, expand=expand)
+
+
+def get_customers_by_id(ids, expand=()):
+    """ Gets the customers with any of a list of ids in one query
+
+    Args:
+        ids (list): the ids to look up, in the order to return them
+
+    Returns:
+        tuple: (the customers found, in the order asked for, and the ids
+            with no customer)
+    """
+    return repository.get_rows(CUSTOMER, ids, expand=expand)
+
+
+def search_customers(text, limit=None, offset=0, expand=(), filters=None):
+    """ Finds the customers whose name or address has words starting with every
+    word in text, best match first
+
+    Args:
+        text (str): what was typed, e.g. "bea"
+        limit (int): the most customers to return
+        offset (int): how many of the best matches to skip
+        expand (tuple): relations to attach to each customer
+        filters (dict): column -> the value, or list of values, the
+            customers must have
+    """
+    return repository.search_rows(
+        CUSTOMER, text, limit or repository.DEFAULT_SEARCH_LIMIT, offset,
+        filters, expand)
+
+
+def create_customer(customer):
+    """ Creates customer """
+    # Add an `id` property to the customer dictionary
+    customer["id"] = repository.insert(CUSTOMER, customer)
 
     # Return the dictionary with `id` property added
     return customer
 
 
-def delete_customer(id):
-    """ Deletes customer """
-    # Initial -1 value for customers index, in case one isn't found
-    customers_index = -1
+def create_customers(new_customers):
+    """ Creates many customers in one transaction
+
+    Args:
+        new_customers (list): the customer dictionaries sent by the client
+
+    Returns:
+        list: the same dictionaries, each with its new `id` added
+    """
+    ids = repository.insert_many(CUSTOMER, new_customers)
 
-    # Iterate the CUSTOMERS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, customers in enumerate(CUSTOMERS):
-        if customers["id"] == id:
-            # Found the customers. Store the current index.
-            customers_index = index
+    for (customer, id) in zip(new_customers, ids):
+        customer['id'] = id
+
+    return new_customers
+
+
+def delete_customer(id):
+    """ Deletes customer
 
-    # If the customers was found, use pop(int) to remove it from list
-    if customers_index >= 0:
-        CUSTOMERS.pop(customers_index)
+    Returns:
+        bool: False if there is no customer with that id, which forces a
+            404 response by the main module
+    """
+    return repository.delete(CUSTOMER, id)
 
 
 def update_customer(id, new_customer):
-    """ Updates a customer """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        UPDATE Customer
-            SET
-                name = ?,
-                address = ?,
-                email = ?,
-                password = ?
-                
-        WHERE id = ?
-        """, (new_customer['name'], new_customer['address'],
-              new_customer['email'], new_customer['password'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
-
-    if rows_affected == 0:
-        # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True
-
-
-def get_customer_by_email(email):
-    """ Gets a customer by their email """
-
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        select
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        from Customer c
-        WHERE c.email = ?
-        """, (email, ))
-
-        customers = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            customer = Customer(
-                row['id'], row['name'], row['address'], row['email'], row['password'])
-            customers.append(customer.__dict__)
-
-    return customers
+    """ Updates a customer
+
+    Returns:
+        bool: False if there is no customer with that id, which forces a
+            404 response by the main module
+    """
+    return repository.update(CUSTOMER, id, new_customer)
+
+
+def update_customers(new_customers):
+    """ Updates many customers in one transaction, each identified by the
+    `id` in its dictionary. Nothing is changed if any of them is missing.
+
+    Returns:
+        list: the ids that don't exist, which forces a 404 response by
+            the main module; empty when every customer was updated
+    """
+    return repository.update_many(CUSTOMER, new_customers)
+
+
+def get_customer_by_email(email, limit=None, after=None):
+    """ Gets the customers with an email
+
+    Args:
+        limit (int): the most customers to return, all of them if None
+        after (int): only return customers whose id is greater than this
+    """
+    return list(repository.iter_rows(CUSTOMER, limit, after,
+                                     {"email": email}))
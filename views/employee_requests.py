@@ -1,185 +1,115 @@
-import sqlite3
-import json
-from models import Employee
-from models import Location
-
-EMPLOYEES = [
-    {
-        "id": 1,
-        "name": "Jenna Solis"
-    }
-]
-
-
-def get_all_employees():
-    """ Gets all employees """
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        SELECT
-            e.id,
-            e.name,
-            e.address,
-            e.location_id,
-            l.name location_name,
-            l.address location_address
-        FROM Employee e
-        JOIN Location l
-            ON l.id = e.location_id
-        """)
-
-        # Initialize an empty list to hold all employee representations
-        employees = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-
-            # Create an employee instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Employee class above.
-            employee = Employee(row['id'], row['name'], row['address'],
-                                row['location_id'])
-
-            # Create a Customer instance from the current row
-            location = Location(
-                row['id'], row['location_name'], row['location_address'])
-
-            # Add the dictionary representation of the location to the employee
-            employee.location = location.__dict__
-
-            employees.append(employee.__dict__)
-
-    return employees
-
-# Function with a single parameter
-
-
-def get_single_employee(id):
-    """ Gets single employee and additional details """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute("""
-        SELECT
-            e.id,
-            e.name,
-            e.address,
-            e.location_id
-        FROM employee e
-        WHERE e.id = ?
-        """, (id, ))
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an employee instance from the current row
-        employee = Employee(data['id'], data['name'], data['address'],
-                            data['location_id'])
-
-        return employee.__dict__
+from database import repository
+from database.entities import EMPLOYEE
 
 
-def create_employee(employee):
-    """ Creates employee """
-    # Get the id value of the last employee in the list
-    max_id = EMPLOYEES[-1]["id"]
+def iter_all_employees(limit=None, after=None, encoded=False,
+                       expand=(), filters=None):
+    """ Yields all employees, or one page of them
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    Args:
+        limit (int): the most employees to return, all of them if None
+        after (int): only return employees whose id is greater than this
+        encoded (bool): yield JSON text, several rows at a time, instead
+            of dictionaries
+        expand (tuple): relations to attach to each employee, e.g.
+            ("location",); the others are None
+        filters (dict): column -> the value, or list of values, the
+            employees must have
+    """
+    return repository.iter_rows(EMPLOYEE, limit, after, filters,
+                                expand=expand, encoded=encoded)
 
-    # Add an `id` property to the employee dictionary
-    employee["id"] = new_id
 
-    # Add the employee dictionary to the list
-    EMPLOYEES.append(employee)
+def get_all_employees(limit=None, after=None, expand=(), filters=None):
+    """ Same as iter_all_employees, collected into a list """
+    return list(iter_all_employees(limit, after, expand=expand,
+                                   filters=filters))
+
+
+def get_single_employee(id, expand=()):
+    """ Gets a single employee, or None if there isn't one with that id """
+    return repository.get_row(EMPLOYEE, id, expand=expand)
+
+
+def get_employees_by_id(ids, expand=()):
+    """ Gets the employees with any of a list of ids in one query
+
+    Args:
+        ids (list): the ids to look up, in the order to return them
+
+    Returns:
+        tuple: (the employees found, in the order asked for, and the ids
+            with no employee)
+    """
+    return repository.get_rows(EMPLOYEE, ids, expand=expand)
+
+
+def create_employee(employee):
+    """ Creates employee """
+    # Add an `id` property to the employee dictionary
+    employee["id"] = repository.insert(EMPLOYEE, employee)
 
     # Return the dictionary with `id` property added
     return employee
 
 
-def delete_employee(id):
-    """ Deletes employee """
-    # Initial -1 value for employee index, in case one isn't found
-    employee_index = -1
+def create_employees(new_employees):
+    """ Creates many employees in one transaction
+
+    Args:
+        new_employees (list): the employee dictionaries sent by the client
 
-    # Iterate the EMPLOYEES list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, employee in enumerate(EMPLOYEES):
-        if employee["id"] == id:
-            # Found the employee. Store the current index.
-            employee_index = index
+    Returns:
+        list: the same dictionaries, each with its new `id` added
+    """
+    ids = repository.insert_many(EMPLOYEE, new_employees)
+
+    for (employee, id) in zip(new_employees, ids):
+        employee['id'] = id
+
+    return new_employees
+
+
+def delete_employee(id):
+    """ Deletes employee
 
-    # If the employee was found, use pop(int) to remove it from list
-    if employee_index >= 0:
-        EMPLOYEES.pop(employee_index)
+    Returns:
+        bool: False if there is no employee with that id, which forces a
+            404 response by the main module
+    """
+    return repository.delete(EMPLOYEE, id)
 
 
 def update_employee(id, new_employee):
-    """ Updates an employee """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        UPDATE Employee
-            SET
-                name = ?,
-                address = ?,
-                location_id = ?
-                          
-        WHERE id = ?
-        """, (new_employee['name'], new_employee['breed'],
-              new_employee['status'], new_employee['locationId'],
-              new_employee['customerId'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
-
-    if rows_affected == 0:
-        # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True
-
-
-def get_employee_by_location(location_id):
-    """ Gets a employee by their location_id """
-
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        select
-            c.id,
-            c.name,
-            c.address,
-            c.location_id
-        from Employee c
-        WHERE c.location_id = ?
-        """, (location_id, ))
-
-        employees = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            employee = Employee(
-                row['id'], row['name'], row['address'], row['location_id'])
-            employees.append(employee.__dict__)
-
-    return employees
+    """ Updates an employee
+
+    Returns:
+        bool: False if there is no employee with that id, which forces a
+            404 response by the main module
+    """
+    return repository.update(EMPLOYEE, id, new_employee)
+
+
+def update_employees(new_employees):
+    """ Updates many employees in one transaction, each identified by the
+    `id` in its dictionary. Nothing is changed if any of them is missing.
+
+    Returns:
+        list: the ids that don't exist, which forces a 404 response by
+            the main module; empty when every employee was updated
+    """
+    return repository.update_many(EMPLOYEE, new_employees)
+
+
+def get_employee_by_location(location_id, limit=None, after=None,
+                             expand=()):
+    """ Gets the employees at a location_id
+
+    Args:
+        limit (int): the most employees to return, all of them if None
+        after (int): only return employees whose id is greater than this
+        expand (tuple): relations to attach to each employee
+    """
+    return list(repository.iter_rows(EMPLOYEE, limit, after,
+                                     {"location_id": location_id},
+                                     expand=expand))
@@ -1,141 +1,100 @@
-import sqlite3
-import json
-from models import Location
-
-LOCATIONS = [
-    {
-        "id": 1,
-        "name": "Nashville North",
-        "address": "8422 Johnson Pike"
-    },
-    {
-        "id": 2,
-        "name": "Nashville South",
-        "address": "209 Emory Drive"
-    }
-]
-
-
-def get_all_locations():
-    """ Gets all locations """
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        SELECT
-            l.id,
-            l.name,
-            l.address
-        FROM Location l
-        """)
-
-        # Initialize an empty list to hold all location representations
-        locations = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-
-            # Create a location instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Location class above.
-            location = Location(row['id'], row['name'], row['address'])
-
-            locations.append(location.__dict__)
-
-    return locations
-
-# Function with a single parameter
-def get_single_location(id):
-    """ Gets single location and additional details """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute("""
-        SELECT
-            l.id,
-            l.name,
-            l.address
-        FROM location l
-        WHERE l.id = ?
-        """, (id, ))
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an location instance from the current row
-        location = Location(data['id'], data['name'], data['address'])
-
-        return location.__dict__
+from database import repository
+from database.entities import LOCATION
 
 
-def create_location(location):
-    """ Creates location """
-    # Get the id value of the last location in the list
-    max_id = LOCATIONS[-1]["id"]
+def iter_all_locations(limit=None, after=None, encoded=False,
+                       expand=(), filters=None):
+    """ Yields all locations, or one page of them
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    Args:
+        limit (int): the most locations to return, all of them if None
+        after (int): only return locations whose id is greater than this
+        encoded (bool): yield JSON text, several rows at a time, instead
+            of dictionaries
+        expand (tuple): relations to attach; locations have none
+        filters (dict): column -> the value, or list of values, the
+            locations must have
+    """
+    return repository.iter_rows(LOCATION, limit, after, filters,
+                                expand=expand, encoded=encoded)
+
+
+def get_all_locations(limit=None, after=None, expand=(), filters=None):
+    """ Same as iter_all_locations, collected into a list """
+    return list(iter_all_locations(limit, after, expand=expand,
+                                   filters=filters))
+
+
+def get_single_location(id, expand=()):
+    """ Gets a single location, or None if there isn't one with that id """
+    return repository.get_row(LOCATION, id, expand=expand)
 
-    # Add an `id` property to the location dictionary
-    location["id"] = new_id
 
-    # Add the location dictionary to the list
-    LOCATIONS.append(location)
+def get_locations_by_id(ids, expand=()):
+    """ Gets the locations with any of a list of ids in one query
+
+    Args:
+        ids (list): the ids to look up, in the order to return them
+
+    Returns:
+        tuple: (the locations found, in the order asked for, and the ids
+            with no location)
+    """
+    return repository.get_rows(LOCATION, ids, expand=expand)
+
+
+def create_location(location):
+    """ Creates location """
+    # Add an `id` property to the location dictionary
+    location["id"] = repository.insert(LOCATION, location)
 
     # Return the dictionary with `id` property added
     return location
 
 
-def delete_location(id):
-    """ Deletes location """
-    # Initial -1 value for location index, in case one isn't found
-    location_index = -1
+def create_locations(new_locations):
+    """ Creates many locations in one transaction
+
+    Args:
+        new_locations (list): the location dictionaries sent by the client
+
+    Returns:
+        list: the same dictionaries, each with its new `id` added
+    """
+    ids = repository.insert_many(LOCATION, new_locations)
+
+    for (location, id) in zip(new_locations, ids):
+        location['id'] = id
+
+    return new_locations
 
-    # Iterate the LOCATIONS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, location in enumerate(LOCATIONS):
-        if location["id"] == id:
-            # Found the location. Store the current index.
-            location_index = index
 
-    # If the location was found, use pop(int) to remove it from list
-    if location_index >= 0:
-        LOCATIONS.pop(location_index)
+def delete_location(id):
+    """ Deletes location
+
+    Returns:
+        bool: False if there is no location with that id, which forces a
+            404 response by the main module
+    """
+    return repository.delete(LOCATION, id)
 
 
 def update_location(id, new_location):
-    """ Updates location """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        UPDATE Location
-            SET
-                name = ?,
-                address = ?
-                          
-        WHERE id = ?
-        """, (new_location['name'], new_location['address'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
-
-    if rows_affected == 0:
-        # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True
+    """ Updates location
+
+    Returns:
+        bool: False if there is no location with that id, which forces a
+            404 response by the main module
+    """
+    return repository.update(LOCATION, id, new_location)
+
+
+def update_locations(new_locations):
+    """ Updates many locations in one transaction, each identified by the
+    `id` in its dictionary. Nothing is changed if any of them is missing.
+
+    Returns:
+        list: the ids that don't exist, which forces a 404 response by
+            the main module; empty when every location was updated
+    """
+    return repository.update_many(LOCATION, new_locations)
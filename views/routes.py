@@ -0,0 +1,76 @@
+from .animal_requests import iter_all_animals, get_single_animal, get_animals_by_id
+from .animal_requests import create_animal, create_animals, update_animal, update_animals
+from .animal_requests import delete_animal, search_animals
+
+from .customer_requests import iter_all_customers, get_single_customer, get_customers_by_id
+from .customer_requests import create_customer, create_customers, update_customer, update_customers
+from .customer_requests import delete_customer, search_customers
+
+from .employee_requests import iter_all_employees, get_single_employee, get_employees_by_id
+from .employee_requests import create_employee, create_employees, update_employee, update_employees
+from .employee_requests import delete_employee
+
+from .location_requests import iter_all_locations, get_single_location, get_locations_by_id
+from .location_requests import create_location, create_locations, update_location, update_locations
+from .location_requests import delete_location
+
+
+class Route():
+    """ The view functions that answer each method for one resource, so
+    the request handler looks them up instead of testing the resource
+    name in every method.
+
+    Args:
+        iter_all (function): GET /<resource>, with limit, after, encoded,
+            expand and filters
+        get_single (function): GET /<resource>/<id>
+        get_by_id (function): GET /<resource>?id=1,5,9
+        create (function): POST of one entity
+        create_many (function): POST of a list of entities
+        update (function): PUT /<resource>/<id>
+        update_many (function): PUT of a list of entities
+        delete (function): DELETE /<resource>/<id>
+        filters (tuple): the query parameters a list may be filtered by,
+            each named after the column it matches. Only indexed columns
+            belong here, so no filter scans the table.
+        search (function): GET /<resource>?q=, with text, limit, offset,
+            expand and filters; None if the resource can't be searched
+    """
+
+    def __init__(self, iter_all, get_single, get_by_id, create, create_many,
+                 update, update_many, delete, filters=(), search=None):
+        self.iter_all = iter_all
+        self.get_single = get_single
+        self.get_by_id = get_by_id
+        self.create = create
+        self.create_many = create_many
+        self.update = update
+        self.update_many = update_many
+        self.delete = delete
+        self.filters = filters
+        self.search = search
+
+
+ROUTES = {
+    "animals": Route(
+        iter_all_animals, get_single_animal, get_animals_by_id,
+        create_animal, create_animals, update_animal, update_animals,
+        delete_animal,
+        filters=("location_id", "customer_id", "status"),
+        search=search_animals),
+    "customers": Route(
+        iter_all_customers, get_single_customer, get_customers_by_id,
+        create_customer, create_customers, update_customer, update_customers,
+        delete_customer,
+        filters=("email",),
+        search=search_customers),
+    "employees": Route(
+        iter_all_employees, get_single_employee, get_employees_by_id,
+        create_employee, create_employees, update_employee, update_employees,
+        delete_employee,
+        filters=("location_id",)),
+    "locations": Route(
+        iter_all_locations, get_single_location, get_locations_by_id,
+        create_location, create_locations, update_location, update_locations,
+        delete_location),
+}
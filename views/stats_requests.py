@@ -0,0 +1,7 @@
+from database import stats
+
+
+def get_stats():
+    """ Gets the animals per location and status, and the employees per
+    location, from counts kept as they change """
+    return stats.get_stats()